@@ -0,0 +1,225 @@
+"""Online snapshots of the SQLite database, copied with the incremental backup API while the app keeps serving requests.
+
+Snapshots are gzip files with a sha256 checksum file next to them, in the format of "sha256sum". From the command line:
+
+    python -m app.backup snapshot
+    python -m app.backup restore backups/snapshot-20250101T000000000000Z.db.gz
+"""
+
+import asyncio
+import gzip
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime, timezone
+
+from sqlalchemy.engine import make_url
+
+from app.config import config
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Snapshot:
+    path: str
+    sha256: str
+    size: int  # Bytes of the compressed file
+    pages: int
+    restarts: (
+        int  # Times SQLite started the copy over because the database was written to
+    )
+    seconds: float
+
+
+def database_path(url: str | None = None) -> str:
+    url = make_url(url or config.DATABASE_URL)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:"):
+        raise ValueError("Snapshots are only supported for SQLite database files")
+    return url.database
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def _copy(
+    source_path: str,
+    target_path: str,
+    pages_per_step: int,
+    step_sleep: float,
+    max_restarts: int,
+):
+    """Copies the database in steps of "pages_per_step" pages. Blocking, so it runs in a thread.
+
+    SQLite starts the copy over whenever another connection writes to the database between two steps. Under steady
+    writes that could go on forever, so after "max_restarts" restarts the copy is done again in a single step, which
+    keeps writers waiting until it ends.
+    """
+    pages = 0
+    restarts = 0
+    last_remaining = None
+
+    def progress(status: int, remaining: int, total: int) -> None:
+        nonlocal pages, restarts, last_remaining
+        pages = total
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+            if restarts >= max_restarts:
+                raise _TooManyRestarts()  # Aborts the copy
+        last_remaining = remaining
+        if remaining:
+            # No lock is held between steps, so the queries of the app run meanwhile
+            time.sleep(step_sleep)
+
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        try:
+            source.backup(target, pages=pages_per_step, progress=progress)
+        except _TooManyRestarts:
+            logger.warning(
+                f"Database changed during {restarts} copies, copying it in one step"
+            )
+            source.backup(target)
+    finally:
+        target.close()
+        source.close()
+    return pages, restarts
+
+
+def _compress(source_path: str, target_path: str) -> str:
+    """Gzips the file and returns the sha256 of the compressed bytes"""
+    digest = hashlib.sha256()
+    with open(source_path, "rb") as source, open(target_path, "wb") as target:
+        with (
+            gzip.GzipFile(
+                fileobj=_HashingWriter(target, digest),
+                mode="wb",
+                compresslevel=6,  # About 4 times faster than the default 9, for a slightly bigger file
+            ) as gz
+        ):
+            shutil.copyfileobj(source, gz, 1024 * 1024)
+    with open(f"{target_path}.sha256", "w") as checksum:
+        checksum.write(f"{digest.hexdigest()}  {os.path.basename(target_path)}\n")
+    return digest.hexdigest()
+
+
+class _HashingWriter:
+    """File wrapper hashing everything written through it"""
+
+    def __init__(self, file, digest) -> None:
+        self.file = file
+        self.digest = digest
+
+    def write(self, data: bytes) -> int:
+        self.digest.update(data)
+        return self.file.write(data)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+
+def _snapshot(
+    source_path: str,
+    backup_dir: str,
+    pages_per_step: int,
+    step_sleep: float,
+    max_restarts: int,
+) -> Snapshot:
+    start = time.perf_counter()
+    os.makedirs(backup_dir, exist_ok=True)
+    name = f"snapshot-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%fZ}.db"
+    raw_path = os.path.join(backup_dir, name)
+    path = f"{raw_path}.gz"
+    try:
+        pages, restarts = _copy(
+            source_path, raw_path, pages_per_step, step_sleep, max_restarts
+        )
+        sha256 = _compress(raw_path, path)
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+    return Snapshot(
+        path=path,
+        sha256=sha256,
+        size=os.path.getsize(path),
+        pages=pages,
+        restarts=restarts,
+        seconds=time.perf_counter() - start,
+    )
+
+
+_snapshot_lock = asyncio.Lock()
+
+
+def snapshot_running() -> bool:
+    return _snapshot_lock.locked()
+
+
+async def create_snapshot(
+    source_path: str | None = None, backup_dir: str | None = None
+) -> Snapshot:
+    """Takes a snapshot without blocking the event loop. Only one snapshot runs at a time"""
+    async with _snapshot_lock:
+        snapshot = await asyncio.to_thread(
+            _snapshot,
+            source_path or database_path(),
+            backup_dir or config.BACKUP_DIR,
+            config.BACKUP_PAGES_PER_STEP,
+            config.BACKUP_STEP_SLEEP_SECONDS,
+            config.BACKUP_MAX_RESTARTS,
+        )
+    logger.info(f"Created snapshot {snapshot.path}", extra=asdict(snapshot))
+    return snapshot
+
+
+def verify_snapshot(path: str) -> None:
+    """Raises ValueError if the snapshot does not match its checksum file"""
+    with open(f"{path}.sha256") as checksum:
+        expected = checksum.read().split()[0]
+    digest = hashlib.sha256()
+    with open(path, "rb") as snapshot:
+        for chunk in iter(lambda: snapshot.read(1024 * 1024), b""):
+            digest.update(chunk)
+    if digest.hexdigest() != expected:
+        raise ValueError(f"Checksum mismatch for {path}, the snapshot is corrupted")
+
+
+def restore_snapshot(path: str, target_path: str | None = None) -> None:
+    """Replaces the database with the snapshot. Meant to be run while the app is stopped"""
+    verify_snapshot(path)
+    target_path = target_path or database_path()
+    with tempfile.TemporaryDirectory() as tmp:
+        raw_path = os.path.join(tmp, "restore.db")
+        with gzip.open(path, "rb") as source, open(raw_path, "wb") as raw:
+            shutil.copyfileobj(source, raw, 1024 * 1024)
+        source = sqlite3.connect(raw_path)
+        target = sqlite3.connect(target_path)
+        try:
+            (result,) = source.execute("PRAGMA integrity_check").fetchone()
+            if result != "ok":
+                raise ValueError(f"Integrity check failed for {path}: {result}")
+            source.backup(
+                target
+            )  # Writes through SQLite, so the target is locked and never left half copied
+        finally:
+            target.close()
+            source.close()
+    logger.info(f"Restored {path} into {target_path}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if sys.argv[1:2] == ["snapshot"]:
+        print(asdict(asyncio.run(create_snapshot())))
+    elif sys.argv[1:2] == ["restore"] and len(sys.argv) == 3:
+        restore_snapshot(sys.argv[2])
+    else:
+        sys.exit("Usage: python -m app.backup snapshot | restore <snapshot file>")
@@ -0,0 +1,178 @@
+"""Cache of serialized responses, together with their compressed versions, for the listings that are read the most.
+
+Entries are grouped by tag, such as "posts" or "comments:1", and a write drops every entry of its tag. Each worker has
+its own cache and only sees its own writes, so COMPRESSION_CACHE_TTL_SECONDS bounds how stale the other workers get.
+"""
+
+import gzip
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+import brotli
+from fastapi import Request, Response
+from pydantic import TypeAdapter
+
+from app.config import config
+from app.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+def _gzip(body: bytes) -> bytes:
+    # mtime=0 so the same body always compresses to the same bytes
+    return gzip.compress(body, compresslevel=config.COMPRESSION_GZIP_LEVEL, mtime=0)
+
+
+def _brotli(body: bytes) -> bytes:
+    return brotli.compress(body, quality=config.COMPRESSION_BROTLI_QUALITY)
+
+
+ENCODERS: dict[str, Callable[[bytes], bytes]] = {"br": _brotli, "gzip": _gzip}
+# Brotli is slower to compress, which the cache pays once per body, and its dictionary shrinks english text further
+PREFERENCE = ("br", "gzip")
+
+
+def negotiate(accept_encoding: str) -> str | None:
+    """Picks the encoding to use from an Accept-Encoding header, or None to send the body as it is"""
+    weights = {}
+    for part in accept_encoding.split(","):
+        name, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[name.strip().lower()] = weight
+    accepted = [
+        encoding
+        for encoding in PREFERENCE
+        if weights.get(encoding, weights.get("*", 0.0)) > 0
+    ]
+    return max(
+        accepted,
+        key=lambda encoding: weights.get(encoding, weights.get("*", 0.0)),
+        default=None,
+    )  # Ties keep the order of PREFERENCE
+
+
+@dataclass
+class CachedBody:
+    tag: str
+    body: bytes  # Serialized json
+    expires_at: float
+    encoded: dict[str, bytes] = field(
+        default_factory=dict
+    )  # Compressed on the first request asking for each encoding
+
+
+class ResponseCache:
+    """Bounded cache of json responses keyed by path and query string, the oldest entries are dropped first"""
+
+    def __init__(self, ttl: float = 60, max_entries: int = 1000) -> None:
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, CachedBody] = OrderedDict()
+        self._generations: dict[str, int] = {}
+        self.clear()
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._generations.clear()
+        self._hits = 0
+        self._misses = 0
+        self._bytes_in = 0  # Size of the bodies served, before compression
+        self._bytes_out = 0  # Size of the bodies actually sent
+        self._serialize_seconds = 0.0
+        self._compress_seconds = 0.0
+        self._compressions = 0
+
+    def invalidate(self, tag: str) -> None:
+        """Drops the entries of "tag". Called after every write changing what they return"""
+        self._generations[tag] = self._generations.get(tag, 0) + 1
+        for key in [key for key, entry in self._entries.items() if entry.tag == tag]:
+            del self._entries[key]
+
+    async def respond(
+        self,
+        request: Request,
+        tag: str,
+        load: Callable[[], Awaitable[Any]],
+        adapter: TypeAdapter,
+        exclude_unset: bool = False,
+    ) -> Response:
+        """Serves the cached body for the url of the request, or calls "load" and serializes its result with "adapter" """
+        key = f"{request.url.path}?{request.url.query}"
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            self._hits += 1
+            self._entries.move_to_end(key)
+        else:
+            self._misses += 1
+            generation = self._generations.get(tag, 0)
+            data = await load()
+            start = time.perf_counter()
+            with span("serialize"):
+                body = adapter.dump_json(
+                    adapter.validate_python(data, from_attributes=True),
+                    exclude_unset=exclude_unset,
+                )
+            self._serialize_seconds += time.perf_counter() - start
+            entry = CachedBody(tag, body, time.monotonic() + self.ttl)
+            if self._generations.get(tag, 0) == generation:
+                # Otherwise a write happened while loading, and the data may be older than it
+                self._store(key, entry)
+
+        headers = {"Vary": "Accept-Encoding"}
+        encoding = None
+        if len(entry.body) >= config.COMPRESSION_MIN_SIZE:
+            encoding = negotiate(request.headers.get("accept-encoding", ""))
+        if encoding is None:
+            content = entry.body
+        else:
+            content = entry.encoded.get(encoding)
+            if content is None:
+                content = self._compress(entry, encoding)
+            headers["Content-Encoding"] = encoding
+        self._bytes_in += len(entry.body)
+        self._bytes_out += len(content)
+        return Response(content, media_type="application/json", headers=headers)
+
+    def _compress(self, entry: CachedBody, encoding: str) -> bytes:
+        start = time.perf_counter()
+        with span(f"compress.{encoding}"):
+            content = ENCODERS[encoding](entry.body)
+        self._compress_seconds += time.perf_counter() - start
+        self._compressions += 1
+        entry.encoded[encoding] = content
+        return content
+
+    def _store(self, key: str, entry: CachedBody) -> None:
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def metrics(self) -> dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "hits": self._hits,
+            "misses": self._misses,
+            "bytes_in": self._bytes_in,
+            "bytes_out": self._bytes_out,
+            "bytes_saved": self._bytes_in - self._bytes_out,
+            "compressions": self._compressions,
+            "compress_ms": self._compress_seconds * 1000,
+            "serialize_ms": self._serialize_seconds * 1000,
+            "encodings": sorted(ENCODERS),
+        }
+
+
+response_cache = ResponseCache(
+    ttl=config.COMPRESSION_CACHE_TTL_SECONDS,
+    max_entries=config.COMPRESSION_CACHE_MAX_ENTRIES,
+)
@@ -19,6 +19,102 @@ class GlobalConfig(BaseConfig):
     DATABASE_URL: Optional[str] = None  # Default value is none
     DB_FORCE_ROLL_BACK: bool = False  # Used to roll changes after every transaction so the database is not changed. Usefull when writting tests to rollback changes after finishing the test. This will be set to true in the tests
 
+    # Background jobs (see app/jobs.py)
+    JOB_QUEUE_MAXSIZE: int = 1000  # Enqueueing waits once this many jobs are pending, so a burst of writes cannot grow memory without limit
+    JOB_WORKERS: int = 2  # Number of worker tasks consuming the queue
+    JOB_MAX_RETRIES: int = (
+        3  # A failing job is retried this many times before being dropped
+    )
+    JOB_RETRY_BACKOFF_SECONDS: float = (
+        0.5  # Delay before the first retry. It doubles on every further attempt
+    )
+    JOB_PERSIST: bool = (
+        False  # Stores pending jobs in the "jobs" table so they survive a restart
+    )
+    JOB_LEASE_SECONDS: float = 60.0  # With JOB_PERSIST, jobs of a process that stopped renewing its claim for this long are taken over by another one
+    JOB_SHUTDOWN_TIMEOUT_SECONDS: float = (
+        5.0  # How long the shutdown waits for pending jobs to finish
+    )
+
+    # Tracing and profiling (see app/tracing.py)
+    TRACING_ENABLED: bool = False  # Writes the spans of every request to TRACE_FILE
+    TRACE_FILE: str = "traces.jsonl"
+    PROFILE_HEADER: str = "X-Debug-Profile"
+    PROFILE_TOKEN: Optional[str] = (
+        None  # Requests whose PROFILE_HEADER matches this value are always profiled. None disables the header
+    )
+    PROFILE_SLOW_REQUEST_MS: Optional[float] = (
+        None  # Every request is sampled, and the profiles of the ones slower than this are kept. None disables it
+    )
+    PROFILE_SAMPLE_INTERVAL_MS: float = (
+        5.0  # How often the stack of a profiled request is sampled
+    )
+    PROFILE_DIR: str = "profiles"  # Where the profiles are written
+
+    # Idempotency keys (see app/idempotency.py)
+    IDEMPOTENCY_TTL_SECONDS: float = (
+        24 * 60 * 60
+    )  # How long a response is replayed for retries
+    IDEMPOTENCY_MAX_KEYS: int = (
+        10000  # Responses kept in memory. The oldest ones are dropped first
+    )
+    IDEMPOTENCY_PERSIST: bool = False  # Also stores the responses in the "idempotency_keys" table, so they survive restarts and are shared by workers
+
+    # Top posts ranking (see app/ranking.py)
+    TOP_POSTS_HALF_LIFE_HOURS: float = (
+        24.0  # A comment counts half as much after this time
+    )
+    TOP_POSTS_CAPACITY: int = (
+        100  # Number of posts kept ranked, and maximum "limit" of /post/top
+    )
+
+    # Batch loading of posts and users (see app/loaders.py)
+    LOADER_MEMOIZE: bool = (
+        True  # Rows loaded during a request are reused for the rest of that request
+    )
+    LOADER_MAX_BATCH_SIZE: int = (
+        500  # Bigger batches are split, SQLite limits the number of query parameters
+    )
+
+    # Database snapshots (see app/backup.py)
+    BACKUP_DIR: str = "backups"
+    BACKUP_PAGES_PER_STEP: int = (
+        256  # Pages copied at a time. The database is only locked while a step runs
+    )
+    BACKUP_STEP_SLEEP_SECONDS: float = (
+        0.005  # Pause between steps, so queries waiting on the database get their turn
+    )
+    BACKUP_MAX_RESTARTS: int = 3  # SQLite starts the copy over when another connection writes. After this many restarts, the copy is done in a single step that makes writers wait
+    # Users allowed to call the /admin endpoints. Set as a json list, e.g. '["admin@example.net"]'
+    ADMIN_EMAILS: list[str] = []
+
+    # Database query deadlines (see app/deadlines.py)
+    DB_DEADLINE_SECONDS: float = 10.0  # Listing queries are interrupted after this long
+    DB_ROUTE_DEADLINES: dict[
+        str, float
+    ] = {}  # Deadlines for specific routes, by endpoint name. Set as json, e.g. '{"get_all_posts": 2}'
+    DB_DISCONNECT_POLL_SECONDS: float = (
+        0.05  # How often a running query checks whether its client is still connected
+    )
+
+    # Filter of registered emails (see app/membership.py)
+    MEMBERSHIP_FALSE_POSITIVE_RATE: float = 0.01  # Share of the unregistered emails that still get looked up in the database
+    MEMBERSHIP_GROWTH_FACTOR: float = 2.0  # The filter is sized for this many times the users registered when it is built, and rebuilt once they are reached
+    MEMBERSHIP_MIN_CAPACITY: int = 1000
+    MEMBERSHIP_SHARED_DATABASE: bool = False  # Must be set when several workers use the same database, so emails registered by the other workers are not reported as missing
+
+    # Compressed response cache (see app/compression.py)
+    COMPRESSION_MIN_SIZE: int = 1024  # Smaller bodies are sent as they are, compressing them saves less than the headers cost
+    COMPRESSION_GZIP_LEVEL: int = 6
+    COMPRESSION_BROTLI_QUALITY: int = 5
+    COMPRESSION_CACHE_TTL_SECONDS: float = (
+        30.0  # How stale a worker can get when another worker writes
+    )
+    COMPRESSION_CACHE_MAX_ENTRIES: int = 1000
+
+    # Post listing
+    POST_MULTI_GET_MAX_IDS: int = 100  # Maximum number of ids in GET /post?ids=
+
 
 class DevConfig(GlobalConfig):
     class Config:
@@ -1,9 +1,9 @@
 """Defines the database schema"""
 
-import databases
 import sqlalchemy
 from app.config import config
-from sqlalchemy import Column, Integer, String, ForeignKey, Table
+from app.tracing import TracedDatabase
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Integer, String, Table, func
 
 metadata = sqlalchemy.MetaData()  # Stores info about database
 
@@ -37,8 +37,38 @@ comments_table = Table(
     Column(
         "user_id", ForeignKey("users.id"), nullable=False
     ),  # Links the posts table with the users table
+    Column(
+        "parent_id", Integer, ForeignKey("comments.id"), nullable=True, index=True
+    ),  # Comment being replied to. Top level comments have no parent
+    Column(
+        "created_at", DateTime, server_default=func.now(), nullable=False, index=True
+    ),  # Set by the database, in UTC
 )
 
+jobs_table = Table(
+    "jobs",
+    metadata,
+    Column("id", Integer, primary_key=True),
+    Column("name", String, nullable=False),  # Name the handler was registered with
+    Column("payload", String, nullable=False),  # Keyword arguments as json
+    Column("attempts", Integer, nullable=False, server_default="0"),
+    Column("created_at", Float, nullable=False),  # Unix timestamp
+    Column("claimed_by", String, nullable=True),  # Owner of the process running it
+    Column(
+        "claimed_at", Float, nullable=True, index=True
+    ),  # Renewed while that process is alive. Once older than JOB_LEASE_SECONDS, another process takes the job
+)  # Pending background jobs, only used when JOB_PERSIST is enabled (see app/jobs.py)
+
+idempotency_keys_table = Table(
+    "idempotency_keys",
+    metadata,
+    Column("user_id", Integer, primary_key=True),
+    Column("key", String, primary_key=True),  # Value of the Idempotency-Key header
+    Column("fingerprint", String, nullable=False),  # Hash of the original request
+    Column("response", String, nullable=False),  # Original response body as json
+    Column("expires_at", Float, nullable=False, index=True),  # Unix timestamp
+)  # Only used when IDEMPOTENCY_PERSIST is enabled (see app/idempotency.py)
+
 
 ### Setting up database connection ###
 engine = sqlalchemy.create_engine(
@@ -50,6 +80,41 @@ engine = sqlalchemy.create_engine(
 
 ### Creating connection to the database ###
 metadata.create_all(engine)  # To actually create the connection to the database
-database = databases.Database(
+
+### Columns added after the tables were first created ###
+# "metadata.create_all" does not alter existing tables, so databases created before these columns need to run the
+# statements below. SQLite cannot add a column defaulting to the current time, so the comments that already exist get
+# the epoch for created_at, which ranks them as old
+PARENT_ID_MIGRATION = """
+ALTER TABLE comments ADD COLUMN parent_id INTEGER REFERENCES comments(id);
+CREATE INDEX ix_comments_parent_id ON comments (parent_id);
+"""
+CREATED_AT_MIGRATION = """
+ALTER TABLE comments ADD COLUMN created_at DATETIME NOT NULL DEFAULT '1970-01-01 00:00:00';
+CREATE INDEX ix_comments_created_at ON comments (created_at);
+"""
+CLAIMED_BY_MIGRATION = """
+ALTER TABLE jobs ADD COLUMN claimed_by VARCHAR;
+ALTER TABLE jobs ADD COLUMN claimed_at FLOAT;
+CREATE INDEX ix_jobs_claimed_at ON jobs (claimed_at);
+"""
+MIGRATIONS = {
+    ("comments", "parent_id"): PARENT_ID_MIGRATION,
+    ("comments", "created_at"): CREATED_AT_MIGRATION,
+    ("jobs", "claimed_by"): CLAIMED_BY_MIGRATION,
+}
+
+
+def check_schema(bind=engine) -> None:
+    """Stops the startup when a column listed in MIGRATIONS is missing, with the statements adding it"""
+    inspector = sqlalchemy.inspect(bind)
+    for (table, column), migration in MIGRATIONS.items():
+        if column not in {c["name"] for c in inspector.get_columns(table)}:
+            raise RuntimeError(
+                f"The {table} table has no {column} column, add it with:\n{migration}"
+            )
+
+
+database = TracedDatabase(
     config.DATABASE_URL, force_rollback=config.DB_FORCE_ROLL_BACK
-)  # Object with which we will interact for the queries
+)  # Object with which we will interact for the queries. Every query is recorded as a span when tracing is enabled
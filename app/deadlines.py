@@ -0,0 +1,73 @@
+"""Deadlines for the database queries of a route, and cancellation of the queries of clients that went away"""
+
+import asyncio
+import logging
+import sqlite3
+
+from fastapi import HTTPException, Request
+
+from app.config import config
+from app.database import database
+from app.tracing import span
+
+logger = logging.getLogger(__name__)
+
+
+def route_deadline(request: Request) -> float:
+    route = request.scope.get("route")
+    name = getattr(route, "name", None)
+    return config.DB_ROUTE_DEADLINES.get(name, config.DB_DEADLINE_SECONDS)
+
+
+async def _watch(request: Request, deadline: float, interrupt) -> str:
+    """Interrupts the running statement when the deadline passes or the client disconnects, and tells which one happened"""
+    loop = asyncio.get_running_loop()
+    end = loop.time() + deadline
+    while True:
+        if await request.is_disconnected():
+            reason = "disconnected"
+            break
+        remaining = end - loop.time()
+        if remaining <= 0:
+            reason = "deadline"
+            break
+        await asyncio.sleep(min(config.DB_DISCONNECT_POLL_SECONDS, remaining))
+    # Cancelling the task would not be enough: the statement keeps running in the thread of the connection
+    await interrupt()
+    return reason
+
+
+async def fetch_all_with_deadline(query, request: Request):
+    """Like "database.fetch_all", but stops the statement once the deadline of the route passes or the client disconnects.
+
+    Raises a 504 when the deadline passed, and a 499 (client closed request) when the client left, which nobody reads.
+    """
+    deadline = route_deadline(request)
+    async with database.connection() as connection:
+        interrupt = getattr(connection.raw_connection, "interrupt", None)
+        if interrupt is None:  # Not SQLite, cancelling is left to the driver
+            try:
+                with span("db.fetch_all"):
+                    return await asyncio.wait_for(connection.fetch_all(query), deadline)
+            except asyncio.TimeoutError as e:
+                raise HTTPException(
+                    status_code=504, detail="The database query took too long"
+                ) from e
+
+        watcher = asyncio.create_task(_watch(request, deadline, interrupt))
+        try:
+            with span("db.fetch_all"):
+                return await connection.fetch_all(query)
+        except sqlite3.OperationalError:
+            if not watcher.done():
+                raise  # Not interrupted by us
+            reason = watcher.result()
+            if reason == "deadline":
+                logger.warning(f"Query interrupted after its {deadline}s deadline")
+                raise HTTPException(
+                    status_code=504, detail="The database query took too long"
+                )
+            logger.info("Query interrupted, the client disconnected")
+            raise HTTPException(status_code=499, detail="Client closed request")
+        finally:
+            watcher.cancel()
@@ -0,0 +1,158 @@
+"""Idempotency keys, so a retried POST replays the first response instead of inserting again"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from fastapi import HTTPException, status
+
+from app.config import config
+from app.database import database, idempotency_keys_table
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StoredResponse:
+    fingerprint: str
+    body: dict
+    expires_at: float
+
+
+class IdempotencyStore:
+    """Bounded store of the responses given to requests carrying an Idempotency-Key header.
+
+    Keys are scoped by user, so two users can send the same key. A key reused with a different request body is rejected.
+    A retry arriving while the original request is still running waits for it instead of inserting a duplicate. That
+    coordination only happens inside one worker; with persistence enabled, workers share the finished responses.
+    """
+
+    def __init__(
+        self, ttl: float = 86400, max_keys: int = 10000, persist: bool = False
+    ) -> None:
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.persist = persist
+        self._entries: OrderedDict[tuple[int, str], StoredResponse] = OrderedDict()
+        self._in_flight: dict[tuple[int, str], asyncio.Future] = {}
+        self._writes = 0
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    async def run(
+        self,
+        user_id: int,
+        key: str | None,
+        request: str,
+        create: Callable[[], Awaitable[dict]],
+    ) -> dict:
+        """Returns the stored response for (user_id, key), or calls "create" and stores its result.
+
+        "request" describes the request, for example the endpoint and its body, and is used to detect reused keys.
+        Failed calls are not stored, so the client can retry them with the same key.
+        """
+        if key is None:
+            return await create()
+        entry_key = (user_id, key)
+        fingerprint = hashlib.sha256(request.encode()).hexdigest()
+        while True:
+            stored = await self._get(entry_key)
+            if stored is not None:
+                if stored.fingerprint != fingerprint:
+                    raise HTTPException(
+                        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                        detail="Idempotency-Key was already used for a different request",
+                    )
+                logger.info(f"Replaying response for idempotency key {key}")
+                return stored.body
+            in_flight = self._in_flight.get(entry_key)
+            if in_flight is None:
+                break
+            # Shielded so a cancelled retry does not cancel the future every waiter shares
+            await asyncio.shield(in_flight)
+
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[entry_key] = future
+        try:
+            body = await create()
+            await self._set(
+                entry_key, StoredResponse(fingerprint, body, time.time() + self.ttl)
+            )
+            return body
+        finally:
+            # Wakes up the waiting retries. They find the stored response, or run "create" themselves if this call failed
+            del self._in_flight[entry_key]
+            future.set_result(None)
+
+    async def _get(self, entry_key: tuple[int, str]) -> StoredResponse | None:
+        now = time.time()
+        while self._entries:
+            oldest_key, oldest = next(iter(self._entries.items()))
+            if oldest.expires_at > now:
+                break  # Entries are mostly kept in expiration order, since they share the same ttl
+            del self._entries[oldest_key]
+
+        stored = self._entries.get(entry_key)
+        if stored is not None and stored.expires_at > now:
+            return stored
+        if not self.persist:
+            return None
+
+        user_id, key = entry_key
+        query = idempotency_keys_table.select().where(
+            idempotency_keys_table.c.user_id == user_id,
+            idempotency_keys_table.c.key == key,
+            idempotency_keys_table.c.expires_at > now,
+        )
+        row = await database.fetch_one(query)
+        if row is None:
+            return None
+        stored = StoredResponse(
+            row.fingerprint, json.loads(row.response), row.expires_at
+        )
+        self._remember(entry_key, stored)
+        return stored
+
+    async def _set(self, entry_key: tuple[int, str], stored: StoredResponse) -> None:
+        self._remember(entry_key, stored)
+        if not self.persist:
+            return
+        user_id, key = entry_key
+        query = (
+            idempotency_keys_table.insert()
+            .prefix_with("OR REPLACE")  # Replaces an expired row left for the same key
+            .values(
+                user_id=user_id,
+                key=key,
+                fingerprint=stored.fingerprint,
+                response=json.dumps(stored.body),
+                expires_at=stored.expires_at,
+            )
+        )
+        await database.execute(query)
+        self._writes += 1
+        if self._writes % 100 == 0:  # Expired rows are cleaned up now and then
+            await database.execute(
+                idempotency_keys_table.delete().where(
+                    idempotency_keys_table.c.expires_at <= time.time()
+                )
+            )
+
+    def _remember(self, entry_key: tuple[int, str], stored: StoredResponse) -> None:
+        self._entries[entry_key] = stored
+        self._entries.move_to_end(entry_key)
+        while len(self._entries) > self.max_keys:
+            self._entries.popitem(last=False)
+
+
+idempotency_store = IdempotencyStore(
+    ttl=config.IDEMPOTENCY_TTL_SECONDS,
+    max_keys=config.IDEMPOTENCY_MAX_KEYS,
+    persist=config.IDEMPOTENCY_PERSIST,
+)
@@ -0,0 +1,322 @@
+"""In-process background jobs, used to run side effects of a request after the response has been sent"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+from sqlalchemy import or_, select
+
+from app.config import config
+from app.database import database, jobs_table
+
+logger = logging.getLogger(__name__)
+
+JobHandler = Callable[..., Awaitable[None]]
+
+
+@dataclass
+class Job:
+    name: str
+    kwargs: dict[str, Any]
+    attempts: int = 0
+    id: int | None = (
+        None  # Row id in the jobs table, only set when the queue is persisted
+    )
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class JobQueue:
+    """Bounded queue consumed by a fixed number of worker tasks.
+
+    Handlers are registered by name so that persisted jobs can be matched to their handler after a restart:
+
+        @job_queue.register("index_post")
+        async def index_post(post_id: int): ...
+
+        await job_queue.enqueue("index_post", post_id=1)
+
+    The keyword arguments of a job must be json serializable when persistence is enabled. Persisted jobs are claimed
+    by the process that runs them, which renews its claim every third of "lease" seconds. Several processes can share
+    the table: each one only runs its own jobs, and takes over the ones whose claim was not renewed in time.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1000,
+        workers: int = 2,
+        max_retries: int = 3,
+        retry_backoff: float = 0.5,
+        persist: bool = False,
+        lease: float = 60.0,
+    ) -> None:
+        self.maxsize = maxsize
+        self.workers = workers
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.persist = persist
+        self.lease = lease
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._claimed: set[int] = (
+            set()
+        )  # Ids of the persisted jobs held by this process
+        self._lease_task: asyncio.Task | None = None
+        self._handlers: dict[str, JobHandler] = {}
+        self._queue: asyncio.Queue[Job] | None = None
+        self._worker_tasks: list[asyncio.Task] = []
+        self._retry_tasks: set[asyncio.Task] = set()
+        self._reset_metrics()
+
+    def _reset_metrics(self) -> None:
+        self._completed = 0
+        self._failed = 0
+        self._retried = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._worker_tasks)
+
+    def register(self, name: str) -> Callable[[JobHandler], JobHandler]:
+        def decorator(handler: JobHandler) -> JobHandler:
+            self._handlers[name] = handler
+            return handler
+
+        return decorator
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._reset_metrics()
+        self._worker_tasks = [
+            asyncio.create_task(self._work(), name=f"job-worker-{i}")
+            for i in range(self.workers)
+        ]  # Workers are started before loading the persisted jobs, otherwise a backlog bigger than "maxsize" would block the startup forever
+        logger.info(f"Started {self.workers} job workers")
+        if self.persist:
+            await self._claim_jobs()
+            self._lease_task = asyncio.create_task(self._keep_lease(), name="job-lease")
+
+    async def stop(self, timeout: float = 5.0) -> None:
+        """Waits up to "timeout" seconds for the pending jobs and then cancels the workers"""
+        if not self.running:
+            return
+        try:
+            await asyncio.wait_for(self.join(), timeout)
+        except asyncio.TimeoutError:
+            pending = self._queue.qsize() + len(self._retry_tasks)
+            if self.persist:
+                logger.warning(
+                    f"{pending} jobs left pending, they will run on the next start"
+                )
+            else:
+                logger.warning(f"Dropping {pending} pending jobs on shutdown")
+        tasks = [*self._worker_tasks, *self._retry_tasks]
+        if self._lease_task is not None:
+            tasks.append(self._lease_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._worker_tasks = []
+        self._retry_tasks = set()
+        self._lease_task = None
+        if self._claimed:
+            # Released so another process, or the next start, runs them without waiting for the lease to expire
+            query = (
+                jobs_table.update()
+                .where(jobs_table.c.claimed_by == self.owner)
+                .values(claimed_by=None, claimed_at=None)
+            )
+            await database.execute(query)
+            self._claimed.clear()
+        logger.info("Stopped job workers", extra=self.metrics())
+
+    async def join(self) -> None:
+        """Waits until every enqueued job, retries included, has been handled"""
+        while True:
+            await self._queue.join()
+            if not self._retry_tasks:
+                return
+            await asyncio.wait(set(self._retry_tasks))
+
+    async def enqueue(self, name: str, **kwargs: Any) -> None:
+        """Adds a job to the queue. Waits for a free slot when the queue is full"""
+        if name not in self._handlers:
+            raise ValueError(f"No job handler registered with name {name!r}")
+        if not self.running:
+            raise RuntimeError("The job queue is not running")
+        job = Job(name=name, kwargs=kwargs)
+        if self.persist:
+            query = jobs_table.insert().values(
+                name=name,
+                payload=json.dumps(kwargs),
+                attempts=0,
+                created_at=time.time(),
+                claimed_by=self.owner,
+                claimed_at=time.time(),
+            )
+            job.id = await database.execute(query)
+            self._claimed.add(job.id)
+        await self._queue.put(job)
+
+    def metrics(self) -> dict[str, Any]:
+        finished = self._completed + self._failed
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "waiting_retry": len(self._retry_tasks),
+            "completed": self._completed,
+            "failed": self._failed,
+            "retried": self._retried,
+            "latency_avg_ms": (self._latency_total / finished * 1000)
+            if finished
+            else 0.0,
+            "latency_max_ms": self._latency_max * 1000,
+        }  # Latency goes from the moment the job is enqueued until it finishes, retries included
+
+    async def _claim_jobs(self) -> None:
+        """Claims the jobs nobody holds, or whose claim expired, and queues them"""
+        free = self.maxsize - self._queue.qsize()
+        if free <= 0:
+            return  # Claimed later, a job claimed now would wait in memory while nobody else can run it
+        now = time.time()
+        claimable = (
+            select(jobs_table.c.id)
+            .where(
+                or_(
+                    jobs_table.c.claimed_by.is_(None),
+                    jobs_table.c.claimed_at < now - self.lease,
+                )
+            )
+            .order_by(jobs_table.c.id)
+            .limit(free)
+        )
+        # A single statement, so two processes can never claim the same job
+        query = (
+            jobs_table.update()
+            .where(jobs_table.c.id.in_(claimable))
+            .values(claimed_by=self.owner, claimed_at=now)
+        )
+        await database.execute(query)
+        query = (
+            jobs_table.select()
+            .where(jobs_table.c.claimed_by == self.owner)
+            .order_by(jobs_table.c.id)
+        )
+        rows = [
+            row
+            for row in await database.fetch_all(query)
+            if row.id not in self._claimed
+        ]
+        queued = 0
+        for row in rows:
+            job = Job(
+                name=row.name,
+                kwargs=json.loads(row.payload),
+                attempts=row.attempts,
+                id=row.id,
+            )
+            try:
+                # Never waits, so the lease keeps being renewed while the workers are busy
+                self._queue.put_nowait(job)
+            except asyncio.QueueFull:
+                break  # Jobs enqueued meanwhile took the free slots
+            self._claimed.add(row.id)
+            queued += 1
+        if queued < len(rows):
+            # Released so they are claimed again once there is room, here or by another process
+            query = (
+                jobs_table.update()
+                .where(jobs_table.c.id.in_([row.id for row in rows[queued:]]))
+                .values(claimed_by=None, claimed_at=None)
+            )
+            await database.execute(query)
+        if queued:
+            logger.info(f"Claimed {queued} persisted jobs")
+
+    async def _keep_lease(self) -> None:
+        """Renews the claim on the jobs of this process, and takes over the jobs of processes that stopped"""
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                query = (
+                    jobs_table.update()
+                    .where(jobs_table.c.claimed_by == self.owner)
+                    .values(claimed_at=time.time())
+                )
+                await database.execute(query)
+                await self._claim_jobs()
+            except Exception:
+                logger.exception("Could not renew the claim on the persisted jobs")
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+            except Exception:
+                logger.exception(f"Unexpected error handling job {job.name}")
+            finally:
+                self._queue.task_done()
+
+    async def _run(self, job: Job) -> None:
+        handler = self._handlers.get(job.name)
+        if handler is None:
+            logger.error(f"No job handler registered with name {job.name!r}")
+            await self._finish(job, succeeded=False)
+            return
+        try:
+            await handler(**job.kwargs)
+        except Exception:
+            job.attempts += 1
+            if job.attempts > self.max_retries:
+                logger.exception(f"Job {job.name} failed after {job.attempts} attempts")
+                await self._finish(job, succeeded=False)
+                return
+            delay = self.retry_backoff * 2 ** (job.attempts - 1)
+            logger.warning(f"Job {job.name} failed, retrying in {delay:.2f}s")
+            self._retried += 1
+            if job.id is not None:
+                query = (
+                    jobs_table.update()
+                    .where(jobs_table.c.id == job.id)
+                    .values(attempts=job.attempts)
+                )
+                await database.execute(query)
+            task = asyncio.create_task(self._retry_later(job, delay))
+            self._retry_tasks.add(task)
+            task.add_done_callback(self._retry_tasks.discard)
+            return
+        await self._finish(job, succeeded=True)
+
+    async def _retry_later(self, job: Job, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await self._queue.put(job)
+
+    async def _finish(self, job: Job, succeeded: bool) -> None:
+        if job.id is not None:
+            await database.execute(jobs_table.delete().where(jobs_table.c.id == job.id))
+            self._claimed.discard(job.id)
+        latency = time.monotonic() - job.enqueued_at
+        self._latency_total += latency
+        self._latency_max = max(self._latency_max, latency)
+        if succeeded:
+            self._completed += 1
+        else:
+            self._failed += 1
+
+
+job_queue = JobQueue(
+    maxsize=config.JOB_QUEUE_MAXSIZE,
+    workers=config.JOB_WORKERS,
+    max_retries=config.JOB_MAX_RETRIES,
+    retry_backoff=config.JOB_RETRY_BACKOFF_SECONDS,
+    persist=config.JOB_PERSIST,
+    lease=config.JOB_LEASE_SECONDS,
+)
@@ -0,0 +1,98 @@
+"""Batch loading: lookups by key made in the same event loop tick are resolved together with a single query"""
+
+import asyncio
+import logging
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Hashable
+
+from app.config import config
+from app.tracing import span
+
+logger = logging.getLogger(__name__)
+
+BatchFunction = Callable[[list[Any]], Awaitable[dict[Any, Any]]]
+
+_request_memo: ContextVar[dict | None] = ContextVar("request_memo", default=None)
+
+
+class BatchLoader:
+    """Collects the keys passed to "load" until the running tick ends, then calls "batch_fn" once with all of them.
+
+    "batch_fn" receives a list of distinct keys and returns a dictionary from key to row, leaving out the keys that
+    were not found. Every caller gets the row of its own key, or None.
+
+    The batch runs in its own task, so it uses its own database connection: rows written inside a transaction that is
+    still open are not visible to it.
+    """
+
+    def __init__(self, name: str, batch_fn: BatchFunction, max_batch_size: int = 500):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max_batch_size
+        self._pending: dict[Hashable, list[asyncio.Future]] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._batches: set[asyncio.Task] = set()
+
+    async def load(self, key: Hashable) -> Any:
+        memo = _request_memo.get()
+        if memo is not None and (self.name, key) in memo:
+            return memo[(self.name, key)]
+
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._pending = {}  # Left over by an event loop that was closed, as happens between tests
+        if not self._pending:
+            # Runs once the tasks that are ready right now had their turn, so their lookups join the batch
+            loop.call_soon(self._dispatch)
+        future = loop.create_future()
+        self._pending.setdefault(key, []).append(future)
+        with span(f"loader.{self.name}"):
+            row = await future
+
+        if memo is not None and row is not None:
+            # Misses are not kept, since the row may be created later in the same request
+            memo[(self.name, key)] = row
+        return row
+
+    def _dispatch(self) -> None:
+        pending, self._pending = self._pending, {}
+        keys = list(pending)
+        for start in range(0, len(keys), self.max_batch_size):
+            batch = {
+                key: pending[key] for key in keys[start : start + self.max_batch_size]
+            }
+            task = asyncio.create_task(self._load_batch(batch))
+            self._batches.add(task)  # The event loop only keeps weak references
+            task.add_done_callback(self._batches.discard)
+
+    async def _load_batch(self, batch: dict[Hashable, list[asyncio.Future]]) -> None:
+        logger.debug(f"Loading {len(batch)} {self.name} keys in one query")
+        try:
+            rows = await self.batch_fn(list(batch))
+        except Exception as e:
+            for futures in batch.values():
+                for future in futures:
+                    if not future.done():  # Done when the waiting request was cancelled
+                        future.set_exception(e)
+            return
+        for key, futures in batch.items():
+            for future in futures:
+                if not future.done():
+                    future.set_result(rows.get(key))
+
+
+class LoaderMemoMiddleware:
+    """Gives every request its own memo, so the batch loaders return the rows a request already loaded without waiting for another batch"""
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http" or not config.LOADER_MEMOIZE:
+            return await self.app(scope, receive, send)
+        token = _request_memo.set({})
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_memo.reset(token)
@@ -59,6 +59,10 @@ def configure_logging() -> None:
                     "datefmt": "%Y-%m-%dT%H:%M-%S",
                     "format": "%(asctime)s.%(msecs)03dZ | %(levelname)-8s | [%(correlation_id)s] %(name)s:%(lineno)d - %(message)s",
                 },
+                "trace": {
+                    "class": "logging.Formatter",
+                    "format": "%(message)s",  # The message already is a json line built in app/tracing.py
+                },
             },
             "handlers": {
                 "default": {
@@ -78,6 +82,16 @@ def configure_logging() -> None:
                     "encoding": "utf8",
                     "filters": ["correlation_id", "email_obfuscation"],
                 },  # Rotating means every time the file gets full, another file is created
+                "traces": {
+                    "class": "logging.handlers.RotatingFileHandler",
+                    "level": "INFO",
+                    "formatter": "trace",
+                    "filename": config.TRACE_FILE,
+                    "maxBytes": 1024 * 1024 * 5,
+                    "backupCount": 5,
+                    "encoding": "utf8",
+                    "delay": True,  # The file is only created once the first trace is written, that is, when tracing is enabled
+                },
             },
             "loggers": {
                 "uvicorn": {
@@ -97,6 +111,11 @@ def configure_logging() -> None:
                     else "INFO",  # Depending on the mode defined in the .env file, I want to select to logging mode. "INFO" mode filters out some logs
                     "propagate": False,  # Doesn't send any logger created in "app", to it's parent, which is the root logger.
                 },
+                "app.tracing.export": {
+                    "handlers": ["traces"],
+                    "level": "INFO",
+                    "propagate": False,  # Traces only go to their own file, not to the console or "app.log"
+                },
                 "databases": {"handlers": ["default"], "level": "WARNING"},
                 "aiosqlite": {"handlers": ["default"], "level": "WARNING"},
             },
@@ -5,10 +5,17 @@ from asgi_correlation_id import CorrelationIdMiddleware
 from fastapi import FastAPI, HTTPException
 from fastapi.exception_handlers import http_exception_handler
 
-from app.database import database
+from app.config import config
+from app.database import check_schema, database
+from app.jobs import job_queue
+from app.loaders import LoaderMemoMiddleware
 from app.logging_conf import configure_logging
+from app.membership import registered_emails
+from app.ranking import top_posts
+from app.routers.admin import router as admin_router
 from app.routers.post import router as post_router
 from app.routers.user import router as user_router
+from app.tracing import TracedJSONResponse, TracingMiddleware
 
 logger = logging.getLogger(__name__)
 
@@ -17,17 +24,29 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     configure_logging()
     logger.info("Hello world")
+    check_schema()  # Before anything queries a column the database may lack
     await database.connect()
+    await top_posts.rebuild()
+    await registered_emails.build()
+    await job_queue.start()
     yield
+    await job_queue.stop(
+        timeout=config.JOB_SHUTDOWN_TIMEOUT_SECONDS
+    )  # Stopped before disconnecting since the jobs may still need the database
     await database.disconnect()
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=TracedJSONResponse)
+app.add_middleware(LoaderMemoMiddleware)
+app.add_middleware(
+    TracingMiddleware
+)  # Added before CorrelationIdMiddleware so it runs inside it and the traces get the correlation id
 app.add_middleware(
     CorrelationIdMiddleware
 )  # To identify in the logs what operation belongs to what user
 app.include_router(post_router, prefix="/api")
 app.include_router(user_router, prefix="/api")
+app.include_router(admin_router, prefix="/api")
 
 
 # This is equivalent to a exception filter in nestjs
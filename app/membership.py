@@ -0,0 +1,217 @@
+"""Bloom filter of the registered emails, so lookups of emails that were never registered skip the database"""
+
+import asyncio
+import hashlib
+import logging
+import math
+from typing import Any
+
+from sqlalchemy import func, select
+
+from app.config import config
+from app.database import database, user_table
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Set of strings that never misses an item that was added, but may wrongly contain one that was not.
+
+    Sized so that the chance of that stays below "false_positive_rate" while it holds up to "capacity" items.
+    """
+
+    def __init__(self, capacity: int, false_positive_rate: float) -> None:
+        self.capacity = max(capacity, 1)
+        self.bits = max(
+            math.ceil(
+                -self.capacity * math.log(false_positive_rate) / math.log(2) ** 2
+            ),
+            8,
+        )
+        self.hashes = max(round(self.bits / self.capacity * math.log(2)), 1)
+        self.items = 0
+        self._array = bytearray(math.ceil(self.bits / 8))
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        # Every position is derived from two hashes, which works as well as computing "hashes" independent ones
+        return ((first + i * second) % self.bits for i in range(self.hashes))
+
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._array[position >> 3] |= 1 << (position & 7)
+        self.items += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(
+            self._array[position >> 3] & (1 << (position & 7))
+            for position in self._positions(item)
+        )
+
+    @property
+    def size(self) -> int:
+        """Memory taken by the bits, in bytes"""
+        return len(self._array)
+
+    def estimated_false_positive_rate(self) -> float:
+        return (1 - math.exp(-self.hashes * self.items / self.bits)) ** self.hashes
+
+
+class RegisteredEmails:
+    """Tells whether an email may be registered. Until "build" is called every email may be, so nothing is skipped.
+
+    Each worker has its own filter, which does not see the users registered by the other workers. When
+    MEMBERSHIP_SHARED_DATABASE is set, an email missing from the filter is only reported as not registered after
+    loading the users created since the last load. Concurrent misses share that query. Loads and rebuilds take turns,
+    so a rebuild never drops the users a load added meanwhile.
+    """
+
+    def __init__(self) -> None:
+        self.clear()
+
+    def clear(self) -> None:
+        self._filter: BloomFilter | None = None
+        self._watermark = 0  # Highest user id loaded into the filter
+        self._added_while_building: list[tuple[str, int]] | None = None
+        self._lock = asyncio.Lock()  # Held by "build" and "_sync_after"
+        self._growing: asyncio.Task | None = None
+        self._current_sync: asyncio.Task | None = None
+        self._next_sync: asyncio.Task | None = None
+        self._checks = 0
+        self._skipped = 0  # Lookups answered by the filter alone
+        self._false_positives = 0  # Lookups the filter let through that found nothing
+        self._syncs = 0
+
+    async def build(self) -> None:
+        """Loads every registered email. Called on startup, and again whenever the filter gets full"""
+        async with self._lock:
+            self._added_while_building = []
+            try:
+                count = await database.fetch_val(
+                    select(func.count()).select_from(user_table)
+                )
+                bloom = BloomFilter(
+                    max(
+                        int(count * config.MEMBERSHIP_GROWTH_FACTOR),
+                        config.MEMBERSHIP_MIN_CAPACITY,
+                    ),
+                    config.MEMBERSHIP_FALSE_POSITIVE_RATE,
+                )
+                watermark = 0
+                query = select(user_table.c.id, user_table.c.email)
+                for row in await database.fetch_all(query):
+                    bloom.add(row.email)
+                    watermark = max(watermark, row.id)
+                for email, user_id in self._added_while_building:
+                    bloom.add(email)  # Registered by this worker after the query ran
+                    if not config.MEMBERSHIP_SHARED_DATABASE:
+                        watermark = max(watermark, user_id)
+            finally:
+                self._added_while_building = None
+            self._filter = bloom
+            # Only what this filter holds. The next load picks up whatever was registered since the query ran
+            self._watermark = watermark
+        logger.info(
+            f"Loaded {bloom.items} registered emails in {bloom.size} bytes",
+            extra={"capacity": bloom.capacity, "hashes": bloom.hashes},
+        )
+
+    def add(self, email: str, user_id: int) -> None:
+        """Records a user registered by this worker"""
+        if self._added_while_building is not None:
+            self._added_while_building.append((email, user_id))
+        if self._filter is None:
+            return
+        self._filter.add(email)
+        if not config.MEMBERSHIP_SHARED_DATABASE:
+            # Otherwise a user registered by another worker with a lower id would be skipped by the next sync
+            self._watermark = max(self._watermark, user_id)
+        self._grow_if_full()
+
+    def _grow_if_full(self) -> None:
+        if self._filter.items > self._filter.capacity and self._growing is None:
+            # The false positive rate climbs quickly past the capacity, so the filter is rebuilt bigger
+            self._growing = asyncio.create_task(self._grow())
+
+    async def _grow(self) -> None:
+        try:
+            await self.build()
+        except Exception:
+            logger.exception("Could not rebuild the registered emails filter")
+        finally:
+            self._growing = None
+
+    async def might_exist(self, email: str) -> bool:
+        """False only when the email is certainly not registered"""
+        if self._filter is None:
+            return True
+        self._checks += 1
+        if email in self._filter:
+            return True
+        if config.MEMBERSHIP_SHARED_DATABASE:
+            try:
+                await self._sync()
+            except Exception:
+                logger.exception("Could not load the newest registered emails")
+                return True  # The caller queries the database instead
+            if email in self._filter:
+                return True
+        self._skipped += 1
+        return False
+
+    def record_miss(self) -> None:
+        """Called when an email the filter let through was not found in the database"""
+        self._false_positives += 1
+
+    async def _sync(self) -> None:
+        """Waits for a load of the newest users that started after this call, so it sees every user committed before.
+
+        A load that is already running may have missed them, so callers arriving meanwhile share the next one.
+        """
+        if self._next_sync is None:
+            self._next_sync = asyncio.create_task(self._sync_after(self._current_sync))
+        await asyncio.shield(self._next_sync)
+
+    async def _sync_after(self, previous: asyncio.Task | None) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])  # Its errors are raised to its own callers
+        self._current_sync, self._next_sync = self._next_sync, None
+        async with self._lock:
+            # Ids only grow, since SQLite commits one write at a time
+            query = select(user_table.c.id, user_table.c.email).where(
+                user_table.c.id > self._watermark
+            )
+            rows = await database.fetch_all(query)
+            self._syncs += 1
+            for row in rows:
+                if row.email not in self._filter:
+                    # Users registered by this worker are already in
+                    self._filter.add(row.email)
+                self._watermark = max(self._watermark, row.id)
+        self._grow_if_full()
+
+    def metrics(self) -> dict[str, Any]:
+        bloom = self._filter
+        negatives = self._skipped + self._false_positives
+        return {
+            "built": bloom is not None,
+            "items": bloom.items if bloom else 0,
+            "capacity": bloom.capacity if bloom else 0,
+            "hashes": bloom.hashes if bloom else 0,
+            "size_bytes": bloom.size if bloom else 0,
+            "estimated_false_positive_rate": bloom.estimated_false_positive_rate()
+            if bloom
+            else 0.0,
+            "observed_false_positive_rate": self._false_positives / negatives
+            if negatives
+            else 0.0,
+            "checks": self._checks,
+            "skipped_queries": self._skipped,
+            "false_positives": self._false_positives,
+            "syncs": self._syncs,
+        }  # The observed rate is the share of the unregistered emails the filter let through
+
+
+registered_emails = RegisteredEmails()
@@ -17,11 +17,20 @@ class UserPost(UserPostIn):
         orm_mode = True
 
 
+class PartialUserPost(BaseModel):
+    """Types output for the post listing, which only includes the fields that were requested"""
+
+    id: int | None = None
+    user_id: int | None = None
+    body: str | None = None  # Cut to "body_length" characters when requested
+
+
 class CommentIn(BaseModel):
     """Types input for comment endpoints"""
 
     body: str
     post_id: int
+    parent_id: int | None = None  # Id of the comment this one replies to
 
 
 class Comment(CommentIn):
@@ -42,3 +51,23 @@ class UserPostWithComments(BaseModel):
 
     post: UserPost
     comments: list[Comment]
+
+
+class CommentThread(Comment):
+    """Types a comment together with its nested replies"""
+
+    replies: list["CommentThread"] = []
+
+
+class PostThread(BaseModel):
+    """Types output for the comment thread endpoint. Pagination applies to the top level comments"""
+
+    post_id: int
+    comments: list[CommentThread]
+
+
+class TopPost(BaseModel):
+    """Types output for the top posts endpoint"""
+
+    post_id: int
+    score: float  # Comments on the post, each one weighted down by its age
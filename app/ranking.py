@@ -0,0 +1,141 @@
+"""In-memory ranking of posts by recent comment activity, kept up to date as comments are created"""
+
+import heapq
+import logging
+import math
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import select
+
+from app.config import config
+from app.database import comments_table, database
+
+logger = logging.getLogger(__name__)
+
+MAX_EXPONENT = 500  # Scores are rescaled before 2 ** exponent gets close to the float limit (about 2 ** 1024)
+HORIZON_HALF_LIVES = 30  # Comments older than this many half-lives weigh less than 1e-9 and are not loaded on rebuild
+
+
+def to_timestamp(created_at: datetime) -> float:
+    return created_at.replace(
+        tzinfo=timezone.utc
+    ).timestamp()  # The database returns naive datetimes in UTC
+
+
+def from_timestamp(at: float) -> datetime:
+    return datetime.fromtimestamp(at, timezone.utc).replace(tzinfo=None)
+
+
+class TopPosts:
+    """Every comment adds 1 to the score of its post, and that point halves every "half_life" seconds.
+
+    Decaying every score on each read would cost O(posts). Instead, a comment made at time t adds
+    2 ** ((t - epoch) / half_life): all the scores decay by the same factor as time passes, so only new comments
+    change the order, and the decayed score is only computed for the posts returned.
+
+    Since the stored scores never decrease, a post can only enter the top "capacity" posts by overtaking the lowest
+    of them. So the top posts are tracked in a min-heap and read without looking at the rest.
+    """
+
+    def __init__(self, half_life: float = 86400, capacity: int = 100) -> None:
+        self.half_life = half_life
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self, epoch: float | None = None) -> None:
+        self._epoch = time.time() if epoch is None else epoch
+        self._scores: dict[int, float] = {}
+        self._top: dict[int, float] = {}  # Scores of the posts in the top
+        self._heap: list[
+            tuple[float, int]
+        ] = []  # Min-heap over "_top". Entries whose score changed since are skipped
+
+    def add(self, post_id: int, at: float) -> None:
+        """Records a comment on "post_id" made at the unix time "at" """
+        exponent = (at - self._epoch) / self.half_life
+        if exponent > MAX_EXPONENT:
+            self._rescale(at)
+            exponent = 0.0
+        score = self._scores.get(post_id, 0.0) + 2**exponent
+        self._scores[post_id] = score
+
+        if post_id not in self._top and len(self._top) >= self.capacity:
+            lowest_score, lowest_id = self._lowest()
+            if score <= lowest_score:
+                return
+            heapq.heappop(self._heap)
+            del self._top[lowest_id]
+        self._top[post_id] = score
+        heapq.heappush(self._heap, (score, post_id))
+        if len(self._heap) > 4 * self.capacity:
+            self._compact()
+
+    def top(self, k: int, now: float | None = None) -> list[tuple[int, float]]:
+        """Returns up to k (post_id, score) pairs, highest score first, with the scores decayed to "now" """
+        now = time.time() if now is None else now
+        decay = 2 ** ((now - self._epoch) / self.half_life)
+        best = heapq.nlargest(k, self._top.items(), key=lambda item: item[1])
+        return [(post_id, score / decay) for post_id, score in best]
+
+    def _lowest(self) -> tuple[float, int]:
+        while True:
+            score, post_id = self._heap[0]
+            if self._top.get(post_id) == score:
+                return score, post_id
+            heapq.heappop(self._heap)  # Left behind when the post got a new score
+
+    def _compact(self) -> None:
+        self._heap = [(score, post_id) for post_id, score in self._top.items()]
+        heapq.heapify(self._heap)
+
+    def _rescale(self, epoch: float) -> None:
+        factor = 2 ** ((self._epoch - epoch) / self.half_life)
+        self._epoch = epoch
+        self._scores = {post_id: s * factor for post_id, s in self._scores.items()}
+        self._top = {post_id: s * factor for post_id, s in self._top.items()}
+        self._compact()
+
+    async def rebuild(self) -> None:
+        """Loads the recent comments from the database. Called on startup"""
+        now = time.time()
+        self.clear(epoch=now)
+        query = select(comments_table.c.post_id, comments_table.c.created_at).where(
+            comments_table.c.created_at
+            >= from_timestamp(now - HORIZON_HALF_LIVES * self.half_life)
+        )
+        rows = await database.fetch_all(query)
+        for row in rows:
+            self.add(row.post_id, to_timestamp(row.created_at))
+        logger.info(f"Ranked {len(self._scores)} posts from {len(rows)} comments")
+
+    async def check_consistency(self, k: int | None = None) -> bool:
+        """Compares the top k posts with a recomputation over every comment in the database"""
+        k = self.capacity if k is None else k
+        now = time.time()
+        query = select(comments_table.c.post_id, comments_table.c.created_at)
+        expected: dict[int, float] = {}
+        for row in await database.fetch_all(query):
+            age = now - to_timestamp(row.created_at)
+            expected[row.post_id] = expected.get(row.post_id, 0.0) + 2 ** (
+                -age / self.half_life
+            )
+        actual = self.top(k, now)
+        ranked = sorted(expected.values(), reverse=True)[:k]
+        consistent = (
+            len(actual) == len(ranked)
+            and all(
+                math.isclose(score, expected_score, rel_tol=1e-6, abs_tol=1e-9)
+                and math.isclose(score, expected[post_id], rel_tol=1e-6, abs_tol=1e-9)
+                for (post_id, score), expected_score in zip(actual, ranked)
+            )
+        )  # Compares scores rather than ids, so posts tied on score may be listed in any order
+        if not consistent:
+            logger.warning("Top posts differ from a full recomputation")
+        return consistent
+
+
+top_posts = TopPosts(
+    half_life=config.TOP_POSTS_HALF_LIFE_HOURS * 3600,
+    capacity=config.TOP_POSTS_CAPACITY,
+)
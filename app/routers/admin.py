@@ -0,0 +1,49 @@
+import logging
+from dataclasses import asdict
+from typing import Annotated
+
+from fastapi import APIRouter, Depends, HTTPException, status
+
+from app.backup import create_snapshot, snapshot_running
+from app.compression import response_cache
+from app.jobs import job_queue
+from app.membership import registered_emails
+from app.models.user import User
+from app.security import get_current_admin
+
+logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+@router.post("/admin/snapshot", status_code=201)
+async def snapshot(admin: Annotated[User, Depends(get_current_admin)]):
+    """Copies the database to a compressed snapshot while the app keeps serving requests"""
+    if snapshot_running():
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="A snapshot is already being taken",
+        )
+    logger.info("Creating database snapshot", extra={"email": admin.email})
+    try:
+        snapshot = await create_snapshot()
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return asdict(snapshot)
+
+
+@router.get("/admin/membership")
+async def membership(_: Annotated[User, Depends(get_current_admin)]):
+    """Size and false positive rate of the filter of registered emails"""
+    return registered_emails.metrics()
+
+
+@router.get("/admin/cache")
+async def cache(_: Annotated[User, Depends(get_current_admin)]):
+    """Hits of the response cache, bytes saved by compression and time spent on it"""
+    return response_cache.metrics()
+
+
+@router.get("/admin/jobs")
+async def jobs(_: Annotated[User, Depends(get_current_admin)]):
+    """Depth of the background job queue, and how long its jobs take"""
+    return job_queue.metrics()
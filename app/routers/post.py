@@ -1,31 +1,112 @@
 import logging
+import time
 from typing import Annotated
 
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request
+from pydantic import TypeAdapter
+from sqlalchemy import func, literal, select
 
+from app.compression import response_cache
+from app.config import config
 from app.database import comments_table, database, post_table
+from app.deadlines import fetch_all_with_deadline
+from app.idempotency import idempotency_store
+from app.loaders import BatchLoader
 from app.models.post import (
     Comment,
     CommentIn,
+    PartialUserPost,
+    PostThread,
+    TopPost,
     UserPost,
     UserPostIn,
     UserPostWithComments,
 )
 from app.models.user import User
+from app.ranking import from_timestamp, top_posts
 from app.security import get_current_user
 
 router = APIRouter()
 
+posts_adapter = TypeAdapter(list[PartialUserPost])
+comments_adapter = TypeAdapter(list[Comment])
+
 logger = logging.getLogger(__name__)
 
 
+async def fetch_posts(post_ids: list[int]) -> dict:
+    query = post_table.select().where(post_table.c.id.in_(post_ids))
+    logger.debug(query)
+    return {post.id: post for post in await database.fetch_all(query)}
+
+
+post_loader = BatchLoader(
+    "post", fetch_posts, max_batch_size=config.LOADER_MAX_BATCH_SIZE
+)  # Concurrent requests looking up posts share a single query
+
+
 async def find_post(post_id: int):
     logger.info(f"Finding posts with id {post_id}")
-    query = post_table.select().where(post_table.c.id == post_id)
+    return await post_loader.load(post_id)
+
+
+async def find_comment(comment_id: int):
+    logger.info(f"Finding comment with id {comment_id}")
+    query = comments_table.select().where(comments_table.c.id == comment_id)
     logger.debug(query)
     return await database.fetch_one(query)
 
 
+def thread_query(
+    post_id: int, limit: int, offset: int, max_depth: int, max_replies: int
+):
+    """Builds the recursive query returning a page of top level comments of a post together with their replies.
+
+    Rows come ordered by depth, so every reply comes after its parent. Both limits are applied inside the recursion,
+    so replies past "max_replies" or "max_depth" are never read, however big the thread is.
+    """
+    top_level = (
+        select(comments_table, literal(0).label("depth"))
+        .where(
+            comments_table.c.post_id == post_id,
+            comments_table.c.parent_id.is_(None),
+        )
+        .order_by(comments_table.c.id)
+        .limit(limit)
+        .offset(offset)
+        .subquery()  # SQLite does not allow LIMIT directly in the first part of a recursive query
+    )
+    thread = select(top_level).cte("thread", recursive=True)
+    sibling = comments_table.alias("sibling")
+    first_replies = (
+        select(sibling.c.id)
+        .where(sibling.c.parent_id == thread.c.id)
+        .order_by(sibling.c.id)
+        .limit(max_replies)
+    )  # Correlated with the parent row, so every comment gets its own first replies through the parent_id index
+    replies = (
+        select(comments_table, (thread.c.depth + 1).label("depth"))
+        .join(thread, comments_table.c.parent_id == thread.c.id)
+        .where(thread.c.depth < max_depth, comments_table.c.id.in_(first_replies))
+    )
+    thread = thread.union_all(replies)
+    return select(thread).order_by(thread.c.depth, thread.c.id)
+
+
+def assemble_thread(rows) -> list[dict]:
+    """Nests the rows of "thread_query" in a single pass"""
+    nodes = {}
+    top_level = []
+    for row in rows:
+        node = {**row._mapping, "replies": []}
+        if node["depth"] == 0:
+            top_level.append(node)
+        else:
+            nodes[node["parent_id"]]["replies"].append(node)
+        nodes[node["id"]] = node
+    return top_level
+
+
 @router.get("/")
 async def root():
     return {"message": "Hello world"}
@@ -33,12 +114,25 @@ async def root():
 
 @router.post("/post", response_model=UserPost, status_code=201)
 async def create_post(
-    post: UserPostIn, user: Annotated[User, Depends(get_current_user)]
+    post: UserPostIn,
+    user: Annotated[User, Depends(get_current_user)],
+    idempotency_key: Annotated[
+        str | None, Header(alias="Idempotency-Key", max_length=255)
+    ] = None,  # Lets clients retry safely: the same key gets the response of the first request instead of a new post
 ):
     # _: User = await get_current_user(
     #     await oauth2_scheme(request)
     # )  # Only authenticated users can access to this endpoint. This line is no longer needed since it was replaced by its dependency injection version with "Depends(get_current_user)" added in the function signature
     logger.info("Creating post")
+    return await idempotency_store.run(
+        user.id,
+        idempotency_key,
+        f"post:{post.model_dump_json()}",
+        lambda: insert_post(post, user),
+    )
+
+
+async def insert_post(post: UserPostIn, user: User) -> dict:
     data = {
         **post.model_dump(),
         "user_id": user.id,
@@ -47,17 +141,113 @@ async def create_post(
         data
     )  # The keys of the dictionary must match the column names
     last_record_id = await database.execute(query)
+    response_cache.invalidate("posts")
     return {**data, "id": last_record_id}
 
 
-@router.get("/post", response_model=list[UserPost])
-async def get_all_posts():
+POST_FIELDS = ("id", "user_id", "body")
+
+
+def parse_fields(fields: str | None) -> list[str]:
+    """Parses the comma separated "fields" parameter of the post listing. Every field is returned when it is missing"""
+    if fields is None:
+        return list(POST_FIELDS)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name not in POST_FIELDS]
+    if not names or unknown:
+        raise HTTPException(
+            status_code=422,
+            detail=f"fields must be a comma separated list of {', '.join(POST_FIELDS)}",
+        )
+    return list(dict.fromkeys(names))  # Drops repeated fields, keeping their order
+
+
+def parse_ids(ids: str) -> list[int]:
+    """Parses the comma separated "ids" parameter of the post listing"""
+    try:
+        post_ids = list(dict.fromkeys(int(post_id) for post_id in ids.split(",")))
+    except ValueError as e:
+        raise HTTPException(
+            status_code=422, detail="ids must be a comma separated list of integers"
+        ) from e
+    if len(post_ids) > config.POST_MULTI_GET_MAX_IDS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"At most {config.POST_MULTI_GET_MAX_IDS} ids can be requested at once",
+        )
+    return post_ids
+
+
+def posts_query(fields: list[str], body_length: int | None, post_ids: list[int] | None):
+    """Selects only the requested columns, so a listing of ids does not read the bodies at all"""
+    columns = [
+        func.substr(post_table.c.body, 1, body_length).label("body")
+        if name == "body" and body_length is not None
+        else post_table.c[name]
+        for name in fields
+    ]  # The body is cut by the database, so the full text is never sent to the app
+    if post_ids is None:
+        return select(*columns)
+    if "id" not in fields:
+        columns.append(post_table.c.id)  # Needed to put the rows in the requested order
+    return select(*columns).where(post_table.c.id.in_(post_ids))
+
+
+@router.get(
+    "/post", response_model=list[PartialUserPost]
+)  # The response model only documents the endpoint, the cache serializes the posts
+async def get_all_posts(
+    request: Request,
+    fields: Annotated[
+        str | None, Query(examples=["id,user_id"])
+    ] = None,  # Comma separated fields to return. All of them by default
+    body_length: Annotated[
+        int | None, Query(ge=1)
+    ] = None,  # Returns only the first characters of the body, as a preview
+    ids: Annotated[
+        str | None, Query(examples=["1,2,3"])
+    ] = None,  # Comma separated ids of the posts to return, in that order. Missing posts are left out
+):
     logger.info("Getting all posts")
-    query = post_table.select()
+    return await response_cache.respond(
+        request,
+        "posts",
+        lambda: load_posts(request, fields, body_length, ids),
+        posts_adapter,
+        exclude_unset=True,  # Leaves out the fields that were not requested instead of sending them as null
+    )  # Served from the cache until a post is created
+
+
+async def load_posts(
+    request: Request, fields: str | None, body_length: int | None, ids: str | None
+) -> list[dict]:
+    names = parse_fields(fields)
+    post_ids = None if ids is None else parse_ids(ids)
+    query = posts_query(names, body_length, post_ids)
 
     logger.debug(query)  # For debugging queries
 
-    return await database.fetch_all(query)
+    rows = await fetch_all_with_deadline(
+        query, request
+    )  # Interrupted if the client disconnects or the deadline passes
+    if post_ids is None:
+        return [{name: row._mapping[name] for name in names} for row in rows]
+    by_id = {row.id: row._mapping for row in rows}
+    return [
+        {name: by_id[post_id][name] for name in names}
+        for post_id in post_ids
+        if post_id in by_id
+    ]
+
+
+@router.get("/post/top", response_model=list[TopPost])
+async def get_top_posts(
+    limit: Annotated[int, Query(ge=1, le=config.TOP_POSTS_CAPACITY)] = 10,
+):  # Declared before "/post/{post_id}", otherwise "top" would be taken as a post id
+    logger.info("Getting top posts")
+    return [
+        {"post_id": post_id, "score": score} for post_id, score in top_posts.top(limit)
+    ]  # Served from memory. The posts themselves can be fetched with their ids
 
 
 @router.post("/comment", response_model=Comment, status_code=201)
@@ -66,36 +256,95 @@ async def create_comment(
     user: Annotated[
         User, Depends(get_current_user)
     ],  # Only authenticated users can access to this endpoint
+    idempotency_key: Annotated[
+        str | None, Header(alias="Idempotency-Key", max_length=255)
+    ] = None,
 ):
     # _: User = await get_current_user(
     #     await oauth2_scheme(request)
     # )  # Only authenticated users can access to this endpoint. This line is no longer needed since it was replaced by its dependency injection version with "Depends(get_current_user)" added in the function signature
     logger.info("Creating a comment")
+    return await idempotency_store.run(
+        user.id,
+        idempotency_key,
+        f"comment:{comment.model_dump_json()}",
+        lambda: insert_comment(comment, user),
+    )
+
+
+async def insert_comment(comment: CommentIn, user: User) -> dict:
     post = await find_post(comment.post_id)
     if not post:
         # logger.error(f"Post with id {comment.post_id} not found") # replaced with the exception handler "http_exception_handle_logger"
         raise HTTPException(status_code=404, detail="Post not found")
+    if comment.parent_id is not None:
+        parent = await find_comment(comment.parent_id)
+        if not parent:
+            raise HTTPException(status_code=404, detail="Parent comment not found")
+        if parent.post_id != comment.post_id:
+            raise HTTPException(
+                status_code=400, detail="Parent comment belongs to another post"
+            )
 
     data = {
         "body": comment.body,
         "post_id": comment.post_id,
         "user_id": user.id,
+        "parent_id": comment.parent_id,
     }  # The created comment is returned with the user who created it
-    query = comments_table.insert().values(data)
+    created_at = time.time()
+    query = comments_table.insert().values(
+        {**data, "created_at": from_timestamp(created_at)}
+    )  # Set here instead of by the database so the ranking gets the exact same time
     last_record_id = await database.execute(query)
+    top_posts.add(comment.post_id, created_at)
+    response_cache.invalidate(f"comments:{comment.post_id}")
     return {**data, "id": last_record_id}
 
 
 @router.get("/post/{post_id}/comments", response_model=list[Comment])
-async def get_comments_on_post(post_id: int):
+async def get_comments_on_post(post_id: int, request: Request):
     logger.info(f"Getting comments on post with id {post_id}")
+    return await response_cache.respond(
+        request,
+        f"comments:{post_id}",
+        lambda: load_comments(post_id, request),
+        comments_adapter,
+    )  # Served from the cache until a comment is made on the post
+
+
+async def load_comments(post_id: int, request: Request):
     query = comments_table.select().where(comments_table.c.post_id == post_id)
     logger.debug(query)
-    return await database.fetch_all(query)
+    return await fetch_all_with_deadline(query, request)
+
+
+@router.get("/post/{post_id}/thread", response_model=PostThread)
+async def get_comment_thread(
+    post_id: int,
+    request: Request,
+    limit: Annotated[
+        int, Query(ge=1, le=100)
+    ] = 20,  # Number of top level comments per page
+    offset: Annotated[int, Query(ge=0)] = 0,
+    max_depth: Annotated[
+        int, Query(ge=0, le=20)
+    ] = 5,  # Replies deeper than this are left out
+    max_replies: Annotated[
+        int, Query(ge=1, le=200)
+    ] = 50,  # Maximum number of replies shown under each comment
+):
+    logger.info(f"Getting comment thread on post with id {post_id}")
+    if not await find_post(post_id):
+        raise HTTPException(status_code=404, detail="Post not found")
+    query = thread_query(post_id, limit, offset, max_depth, max_replies)
+    logger.debug(query)
+    rows = await fetch_all_with_deadline(query, request)
+    return {"post_id": post_id, "comments": assemble_thread(rows)}
 
 
 @router.get("/post/{post_id}", response_model=UserPostWithComments)
-async def get_post_with_comments(post_id: int):
+async def get_post_with_comments(post_id: int, request: Request):
     logger.info(f"Getting post with id {post_id} and its comments")
     post = await find_post(post_id)
     if not post:
@@ -104,5 +353,5 @@ async def get_post_with_comments(post_id: int):
 
     return {
         "post": post,
-        "comments": await get_comments_on_post(post_id),
+        "comments": await load_comments(post_id, request),
     }
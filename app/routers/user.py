@@ -1,33 +1,42 @@
 import logging
+import sqlite3
 
 from fastapi import APIRouter, HTTPException, status
 
 from app.database import database, user_table
+from app.membership import registered_emails
 from app.models.user import UserIn
 from app.security import (
     authenticate_user,
     create_access_token,
+    find_registered_user,
     get_password_hash,
-    get_user,
 )
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
+user_exists_exception = HTTPException(
+    status_code=status.HTTP_400_BAD_REQUEST,
+    detail="A user with that email already exists",
+)
+
 
 @router.post("/register", status_code=201)
 async def register(user: UserIn):
     # First, checking if user is already in database
-    if await get_user(user.email):
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="A user with that email already exists",
-        )
+    if await find_registered_user(user.email):
+        raise user_exists_exception
     hashed_password = get_password_hash(user.password)
     # Actually creating the user
     query = user_table.insert().values(email=user.email, password=hashed_password)
     logger.debug(query)
-    await database.execute(query)
+    try:
+        user_id = await database.execute(query)
+    except sqlite3.IntegrityError as e:
+        # Registered meanwhile by a concurrent request, the email column is unique
+        raise user_exists_exception from e
+    registered_emails.add(user.email, user_id)
     return {"detail": "User created"}
 
 
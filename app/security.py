@@ -7,7 +7,12 @@ from fastapi.security import OAuth2PasswordBearer
 from jose import jwt, ExpiredSignatureError, JWTError
 from passlib.context import CryptContext
 
+from app.config import config
 from app.database import database, user_table
+from app.loaders import BatchLoader
+from app.membership import registered_emails
+from app.models.user import User
+from app.tracing import span, traced
 
 logger = logging.getLogger(__name__)
 
@@ -47,17 +52,35 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
+async def fetch_users_by_email(emails: list[str]) -> dict:
+    query = user_table.select().where(user_table.c.email.in_(emails))
+    return {user.email: user for user in await database.fetch_all(query)}
+
+
+user_loader = BatchLoader(
+    "user", fetch_users_by_email, max_batch_size=config.LOADER_MAX_BATCH_SIZE
+)  # Concurrent requests looking up users share a single query
+
+
 async def get_user(email: str):
     logger.debug("Fetching user from the database", extra={"email": email})
-    query = user_table.select().where(user_table.c.email == email)
-    result = await database.fetch_one(query)
-    if result:
-        return result
+    return await user_loader.load(email)
+
+
+async def find_registered_user(email: str):
+    """Like "get_user", but skips the query for emails that were certainly never registered"""
+    if not await registered_emails.might_exist(email):
+        logger.debug("Email not registered, skipping query", extra={"email": email})
+        return None
+    user = await get_user(email)
+    if user is None:
+        registered_emails.record_miss()
+    return user
 
 
 async def authenticate_user(email: str, password: str):
     logger.debug("Authenticating user", extra={"email": email})
-    user = await get_user(email)
+    user = await find_registered_user(email)
     if not user:
         raise credentials_exception
     if not verify_password(password, user.password):
@@ -65,12 +88,14 @@ async def authenticate_user(email: str, password: str):
     return user
 
 
+@traced("dependency.get_current_user")
 async def get_current_user(
     token: Annotated[str, Depends(oauth2_scheme)],
 ):  # Depends(oauth2_scheme) allows the function to automatically grab the token from the request instead of us having to pass it to the function as a string
     """Checks if the token given by the user is a valid token. If it is, returns the user according to the email stored in the token payload. This function is used to protect the endpoints from unauthenticated users"""
     try:
-        payload = jwt.decode(token, key=SECRET_KEY, algorithms=[ALGORITHM])
+        with span("jwt.decode"):
+            payload = jwt.decode(token, key=SECRET_KEY, algorithms=[ALGORITHM])
         email = payload.get("sub")
         if email is None:
             raise credentials_exception
@@ -87,3 +112,14 @@ async def get_current_user(
     if user is None:
         raise credentials_exception
     return user
+
+
+async def get_current_admin(
+    user: Annotated[User, Depends(get_current_user)],
+):
+    """Like "get_current_user", but only lets through the users listed in ADMIN_EMAILS"""
+    if user.email not in config.ADMIN_EMAILS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Admin rights required"
+        )
+    return user
@@ -0,0 +1,260 @@
+"""Per-request span tracing tied to the correlation id, and a sampling profiler for slow or flagged requests"""
+
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import wraps
+from typing import Any, Iterator
+
+import databases
+from asgi_correlation_id import correlation_id
+from fastapi.responses import JSONResponse
+
+from app.config import config
+
+logger = logging.getLogger(__name__)
+export_logger = logging.getLogger(
+    "app.tracing.export"
+)  # Every finished trace is logged here as a json line. "logging_conf" sends it to its own file
+
+
+@dataclass
+class Span:
+    name: str
+    start: float  # Seconds since the beginning of the request
+    parent: int | None  # Index of the parent span in "Trace.spans"
+    duration: float | None = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class Trace:
+    started_at: float = field(default_factory=time.perf_counter)
+    spans: list[Span] = field(default_factory=list)
+
+    def as_dict(self) -> list[dict]:
+        return [
+            {
+                "name": s.name,
+                "start_ms": round(s.start * 1000, 3),
+                "duration_ms": round((s.duration or 0) * 1000, 3),
+                "parent": s.parent,
+                **s.attributes,
+            }
+            for s in self.spans
+        ]
+
+
+_trace: ContextVar[Trace | None] = ContextVar("trace", default=None)
+_current_span: ContextVar[int | None] = ContextVar("current_span", default=None)
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[None]:
+    """Records how long the block takes. Does nothing outside of a traced request, so it is cheap to leave in place"""
+    trace = _trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    current = Span(
+        name=name,
+        start=start - trace.started_at,
+        parent=_current_span.get(),
+        attributes=attributes,
+    )
+    trace.spans.append(current)
+    token = _current_span.set(len(trace.spans) - 1)
+    try:
+        yield
+    finally:
+        current.duration = time.perf_counter() - start
+        _current_span.reset(token)
+
+
+def traced(name: str):
+    """Decorator version of "span" for async functions, such as FastAPI dependencies"""
+
+    def decorator(func):
+        # "wraps" keeps the signature, so FastAPI still resolves the parameters of a dependency
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TracedDatabase(databases.Database):
+    """Database that records a span for every query"""
+
+    async def fetch_all(self, query, values=None):
+        with span("db.fetch_all"):
+            return await super().fetch_all(query, values)
+
+    async def fetch_one(self, query, values=None):
+        with span("db.fetch_one"):
+            return await super().fetch_one(query, values)
+
+    async def fetch_val(self, query, values=None, column=0):
+        with span("db.fetch_val"):
+            return await super().fetch_val(query, values, column)
+
+    async def execute(self, query, values=None):
+        with span("db.execute"):
+            return await super().execute(query, values)
+
+    async def execute_many(self, query, values):
+        with span("db.execute_many"):
+            return await super().execute_many(query, values)
+
+
+class TracedJSONResponse(JSONResponse):
+    """Records the json encoding of the response body as the "serialize" span"""
+
+    def render(self, content: Any) -> bytes:
+        with span("serialize"):
+            return super().render(content)
+
+
+class StackSampler:
+    """Low overhead profiler: a thread takes the stack of the event loop every "interval" seconds.
+
+    Each sample is credited to the request whose task was running at that moment, so the profile of a request only
+    holds its own work. Time spent waiting, on the database for example, is not sampled. The thread only wakes up while
+    some request is being watched.
+    """
+
+    def __init__(self) -> None:
+        self._watched: dict[asyncio.Task, Counter] = {}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread: int | None = None
+        self._wake = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def watch(self, task: asyncio.Task) -> Counter:
+        """Starts sampling "task". Returns the counter of its stacks, which keeps filling until "unwatch" is called"""
+        self._loop = task.get_loop()
+        self._loop_thread = threading.get_ident()
+        samples = self._watched[task] = Counter()
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._run, name="stack-sampler", daemon=True
+            )
+            self._thread.start()
+        self._wake.set()
+        return samples
+
+    def unwatch(self, task: asyncio.Task) -> None:
+        self._watched.pop(task, None)
+
+    def _run(self) -> None:
+        while True:
+            if not self._watched:
+                self._wake.clear()
+                self._wake.wait()
+            time.sleep(config.PROFILE_SAMPLE_INTERVAL_MS / 1000)
+            frame = sys._current_frames().get(self._loop_thread)
+            # The task running on the loop right now. Read without locking, a sample may rarely go to the wrong task
+            samples = self._watched.get(asyncio.tasks._current_tasks.get(self._loop))
+            if frame is None or samples is None:
+                continue  # The loop is idle, or running a request that is not watched
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+                frame = frame.f_back
+            samples[";".join(reversed(stack))] += 1
+
+
+stack_sampler = StackSampler()
+
+
+def _profile_reason(headers: dict[bytes, bytes]) -> str | None:
+    header = headers.get(config.PROFILE_HEADER.lower().encode())
+    if config.PROFILE_TOKEN and header == config.PROFILE_TOKEN.encode():
+        return "header"
+    if config.PROFILE_SLOW_REQUEST_MS is not None:
+        # Every request is sampled, the profile is only kept if it ends up being slower than the threshold
+        return "slow"
+    return None
+
+
+def _dump_profile(samples: Counter) -> str:
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    path = os.path.join(
+        config.PROFILE_DIR,
+        f"{int(time.time() * 1000)}-{correlation_id.get()}.folded",
+    )
+    with open(path, "w") as profile:
+        # Collapsed stacks with their number of samples, as read by flamegraph.pl or speedscope
+        for stack, count in samples.most_common():
+            profile.write(f"{stack} {count}\n")
+    return path
+
+
+class TracingMiddleware:
+    """Traces every request when TRACING_ENABLED, and profiles the requests selected by "_profile_reason".
+
+    It must run inside CorrelationIdMiddleware, so the correlation id is already set when the trace is exported.
+    """
+
+    def __init__(self, app) -> None:
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        reason = _profile_reason(dict(scope["headers"]))
+        if not config.TRACING_ENABLED and reason is None:
+            return await self.app(scope, receive, send)
+
+        status_code = 500
+
+        async def send_wrapper(message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        trace = Trace()
+        token = _trace.set(trace)
+        task = asyncio.current_task()
+        samples = None if reason is None else stack_sampler.watch(task)
+        try:
+            with span("middleware"):
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            duration_ms = (time.perf_counter() - trace.started_at) * 1000
+            _trace.reset(token)
+            if samples is not None:
+                stack_sampler.unwatch(task)
+                if reason == "header" or duration_ms >= config.PROFILE_SLOW_REQUEST_MS:
+                    path = _dump_profile(samples)
+                    logger.info(
+                        f"Profiled {scope['method']} {scope['path']} ({duration_ms:.1f}ms, {samples.total()} samples) to {path}"
+                    )
+            if config.TRACING_ENABLED:
+                export_logger.info(
+                    json.dumps(
+                        {
+                            "correlation_id": correlation_id.get(),
+                            "method": scope["method"],
+                            "path": scope["path"],
+                            "status_code": status_code,
+                            "duration_ms": round(duration_ms, 3),
+                            "spans": trace.as_dict(),
+                        }
+                    )
+                )
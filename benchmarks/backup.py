@@ -0,0 +1,106 @@
+"""Measures the latency of database reads and writes while a snapshot is taken.
+
+Compares no snapshot, the incremental snapshot of app/backup.py, and a copy in a single step:
+
+    python -m benchmarks.backup --posts 100000 --concurrency 20 --write-ratio 0.1
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import tempfile
+import time
+
+# Like in tests/conftest.py, the configuration must be set before importing the app
+DATABASE_DIR = tempfile.mkdtemp()
+os.environ["ENV_STATE"] = "test"
+os.environ["TEST_DATABASE_URL"] = f"sqlite:///{os.path.join(DATABASE_DIR, 'bench.db')}"
+os.environ["TEST_DB_FORCE_ROLL_BACK"] = "false"  # Real connections, as in production
+
+from app import backup  # noqa: E402
+from app.config import config  # noqa: E402
+from app.database import database, post_table, user_table  # noqa: E402
+
+
+async def load(
+    posts: int, write_ratio: float, latencies: list[float], stop: asyncio.Event
+) -> None:
+    """Sends reads and writes one after the other until "stop" is set"""
+    while not stop.is_set():
+        start = time.perf_counter()
+        if random.random() < write_ratio:
+            await database.execute(
+                post_table.insert().values(body="new post", user_id=1)
+            )
+        else:
+            post_id = random.randint(1, posts)
+            await database.fetch_one(
+                post_table.select().where(post_table.c.id == post_id)
+            )
+        latencies.append(time.perf_counter() - start)
+
+
+async def measure(args, snapshot: bool) -> tuple[list[float], backup.Snapshot | None]:
+    latencies: list[float] = []
+    stop = asyncio.Event()
+    workers = [
+        asyncio.create_task(load(args.posts, args.write_ratio, latencies, stop))
+        for _ in range(args.concurrency)
+    ]
+    result = None
+    if snapshot:
+        result = await backup.create_snapshot(backup_dir=DATABASE_DIR)
+        os.remove(result.path)
+        os.remove(f"{result.path}.sha256")
+    else:
+        await asyncio.sleep(args.seconds)
+    stop.set()
+    await asyncio.gather(*workers)
+    return latencies, result
+
+
+def report(name: str, latencies: list[float], result: backup.Snapshot | None) -> None:
+    ms = sorted(latency * 1000 for latency in latencies)
+    quantiles = statistics.quantiles(ms, n=100)
+    line = f"{name:>12} | {len(ms):>8} | {quantiles[49]:>7.2f} | {quantiles[98]:>7.2f} | {ms[-1]:>8.2f}"
+    if result:
+        line += f" | {result.seconds:>6.2f}s, {result.restarts} restarts"
+    print(line)
+
+
+async def main(args) -> None:
+    await database.connect()
+    await database.execute(
+        user_table.insert().values(email="bench@example.net", password="-")
+    )
+    await database.execute_many(
+        post_table.insert(), [{"body": "x" * 400, "user_id": 1}] * args.posts
+    )
+
+    print(
+        f"{args.posts} posts, {args.concurrency} concurrent clients, {args.write_ratio:.0%} writes"
+    )
+    print(
+        f"{'snapshot':>12} | {'queries':>8} | {'p50 ms':>7} | {'p99 ms':>7} | {'max ms':>8} | duration"
+    )
+    report("none", *await measure(args, snapshot=False))
+    report("incremental", *await measure(args, snapshot=True))
+    config.BACKUP_PAGES_PER_STEP = -1  # The whole database in one step
+    report("single step", *await measure(args, snapshot=True))
+    await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, default=100000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--write-ratio", type=float, default=0.1)
+    parser.add_argument(
+        "--seconds",
+        type=float,
+        default=3.0,
+        help="Duration of the run without snapshot",
+    )
+    asyncio.run(main(parser.parse_args()))
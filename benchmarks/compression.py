@@ -0,0 +1,88 @@
+"""Compares serializing and compressing a post listing on every request with serving it from the response cache.
+
+Runs without a database, on generated posts:
+
+    python -m benchmarks.compression --posts 100 1000 10000 --requests 200
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import string
+import time
+
+# Like in tests/conftest.py, the configuration must be set before importing the app
+os.environ["ENV_STATE"] = "test"
+
+from fastapi import Request  # noqa: E402
+from pydantic import TypeAdapter  # noqa: E402
+
+from app.compression import ENCODERS, ResponseCache  # noqa: E402
+from app.models.post import PartialUserPost  # noqa: E402
+
+posts_adapter = TypeAdapter(list[PartialUserPost])  # As in app/routers/post.py
+
+
+def make_posts(count: int) -> list[dict]:
+    words = ["".join(random.choices(string.ascii_lowercase, k=6)) for _ in range(500)]
+    return [
+        {
+            "id": i,
+            "user_id": random.randint(1, 100),
+            "body": " ".join(random.choices(words, k=random.randint(10, 60))),
+        }
+        for i in range(count)
+    ]
+
+
+def make_request(encoding: str) -> Request:
+    return Request(
+        {
+            "type": "http",
+            "path": "/api/post",
+            "query_string": b"",
+            "headers": [(b"accept-encoding", encoding.encode())],
+        }
+    )
+
+
+async def run(cache: ResponseCache, posts: list[dict], encoding: str, requests: int):
+    """Returns the milliseconds per request and the size of the body sent"""
+
+    async def load():
+        return posts
+
+    start = time.perf_counter()
+    for _ in range(requests):
+        response = await cache.respond(
+            make_request(encoding), "posts", load, posts_adapter
+        )
+    return (time.perf_counter() - start) / requests * 1000, len(response.body)
+
+
+async def main(sizes: list[int], requests: int) -> None:
+    print(f"{requests} requests per run, encodings available: {', '.join(ENCODERS)}")
+    print(
+        f"{'posts':>6} | {'encoding':>8} | {'mode':>8} | {'bytes':>9} | {'ms/request':>10}"
+    )
+    for size in sizes:
+        posts = make_posts(size)
+        for encoding in ["identity", *ENCODERS]:
+            # A TTL of 0 stores nothing, so every request serializes and compresses again
+            for mode, cache in (
+                ("uncached", ResponseCache(ttl=0)),
+                ("cached", ResponseCache()),
+            ):
+                ms, sent = await run(cache, posts, encoding, requests)
+                print(
+                    f"{size:>6} | {encoding:>8} | {mode:>8} | {sent:>9} | {ms:>10.3f}"
+                )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--posts", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.posts, args.requests))
@@ -0,0 +1,89 @@
+"""Compares one query per lookup with the batch loaders when many lookups run concurrently.
+
+Runs against a temporary SQLite database:
+
+    python -m benchmarks.loaders --users 1000 --lookups 5000 --concurrency 1 10 100 1000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+# Like in tests/conftest.py, the configuration must be set before importing the app
+DATABASE_FILE = os.path.join(tempfile.mkdtemp(), "bench.db")
+os.environ["ENV_STATE"] = "test"
+os.environ["TEST_DATABASE_URL"] = f"sqlite:///{DATABASE_FILE}"
+os.environ["TEST_DB_FORCE_ROLL_BACK"] = "false"  # Real connections, as in production
+
+from app import security  # noqa: E402
+from app.database import database, user_table  # noqa: E402
+
+
+class QueryCounter:
+    """Counts the queries sent through "database" """
+
+    def __init__(self) -> None:
+        self.count = 0
+        for method in ("fetch_one", "fetch_all"):
+            original = getattr(database, method)
+            setattr(database, method, self._counting(original))
+
+    def _counting(self, original):
+        async def wrapper(*args, **kwargs):
+            self.count += 1
+            return await original(*args, **kwargs)
+
+        return wrapper
+
+
+async def get_user_unbatched(email: str):
+    query = user_table.select().where(user_table.c.email == email)
+    return await database.fetch_one(query)
+
+
+async def run(lookup, emails: list[str], lookups: int, concurrency: int) -> float:
+    """Runs "lookups" lookups, "concurrency" at a time, and returns the elapsed seconds"""
+    start = time.perf_counter()
+    for _ in range(lookups // concurrency):
+        await asyncio.gather(
+            *(lookup(random.choice(emails)) for _ in range(concurrency))
+        )
+    return time.perf_counter() - start
+
+
+async def main(users: int, lookups: int, concurrencies: list[int]) -> None:
+    await database.connect()
+    emails = [f"user{i}@example.net" for i in range(users)]
+    await database.execute_many(
+        user_table.insert(), [{"email": email, "password": "-"} for email in emails]
+    )
+    counter = QueryCounter()
+
+    print(f"{users} users, {lookups} lookups per run")
+    print(f"{'concurrency':>11} | {'mode':>9} | {'queries':>7} | {'lookups/s':>9}")
+    for concurrency in concurrencies:
+        for mode, lookup in (
+            ("unbatched", get_user_unbatched),
+            ("batched", security.get_user),
+        ):
+            counter.count = 0
+            elapsed = await run(lookup, emails, lookups, concurrency)
+            done = lookups // concurrency * concurrency
+            print(
+                f"{concurrency:>11} | {mode:>9} | {counter.count:>7} | {done / elapsed:>9.0f}"
+            )
+    await database.disconnect()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 10, 100, 1000]
+    )
+    args = parser.parse_args()
+    asyncio.run(main(args.users, args.lookups, args.concurrency))
@@ -12,8 +12,13 @@ The env variable must be overwritten before loading the app, which imports the d
 """
 os.environ["ENV_STATE"] = "test"  # noqa: E402
 
+from app.compression import response_cache  # noqa: E402
 from app.database import database, user_table  # noqa: E402
+from app.idempotency import idempotency_store  # noqa: E402
 from app.main import app  # noqa: E402
+from app.membership import registered_emails  # noqa: E402
+from app.ranking import top_posts  # noqa: E402
+from tests.helpers import create_comment, create_post  # noqa: E402
 
 
 @pytest.fixture(
@@ -41,6 +46,10 @@ async def db() -> AsyncGenerator:
     await (
         database.connect()
     )  # Thanks to the "autouse", the database is connected before any test begin
+    idempotency_store.clear()  # The stored responses refer to rows that were rolled back by the previous test
+    top_posts.clear()
+    response_cache.clear()  # Cached bodies would list the rows of the previous test
+    registered_emails.clear()  # Not built, so every email is looked up like before
     yield
     await database.disconnect()  # Teardown
 
@@ -71,3 +80,19 @@ async def registered_user(async_client: AsyncClient) -> dict:
 async def logged_in_token(async_client: AsyncClient, registered_user: dict) -> str:
     response = await async_client.post("/login", json=registered_user)
     return response.json()["access_token"]
+
+
+@pytest.fixture()
+async def created_post(async_client: AsyncClient, logged_in_token: str):
+    """Fixture of a created post"""
+    return await create_post("Test post", async_client, logged_in_token)
+
+
+@pytest.fixture()
+async def created_comment(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    """Fixture of a created comment"""
+    return await create_comment(
+        "Test comment", created_post["id"], async_client, logged_in_token
+    )
@@ -0,0 +1,35 @@
+"""Requests shared by the tests that need several posts or comments"""
+
+from httpx import AsyncClient
+
+
+async def create_post(
+    body: str, async_client: AsyncClient, logged_in_token: str
+) -> dict:
+    response = await async_client.post(
+        "/post",
+        json={"body": body},
+        headers={
+            "Authorization": f"Bearer {logged_in_token}"
+        },  # This token is grabbed from the request by security.oauth2_scheme in the controller
+    )
+    return response.json()
+
+
+async def create_comment(
+    body: str,
+    post_id: int,
+    async_client: AsyncClient,
+    logged_in_token: str,
+    parent_id: int | None = None,
+) -> dict:
+    response = await async_client.post(
+        "/comment",
+        json={
+            "body": body,
+            "post_id": post_id,
+            "parent_id": parent_id,
+        },
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+    return response.json()
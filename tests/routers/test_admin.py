@@ -0,0 +1,74 @@
+import pytest
+from httpx import AsyncClient
+
+from app.config import config
+
+
+@pytest.mark.anyio
+async def test_snapshot_requires_admin(async_client: AsyncClient, logged_in_token: str):
+    response = await async_client.post(
+        "/admin/snapshot", headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+    assert response.status_code == 403
+
+
+@pytest.mark.anyio
+async def test_snapshot(
+    async_client: AsyncClient,
+    registered_user: dict,
+    logged_in_token: str,
+    tmp_path,
+    mocker,
+):
+    mocker.patch.object(config, "ADMIN_EMAILS", [registered_user["email"]])
+    mocker.patch.object(config, "BACKUP_DIR", str(tmp_path))
+
+    response = await async_client.post(
+        "/admin/snapshot", headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == 201
+    assert response.json()["path"].startswith(str(tmp_path))
+    assert len(list(tmp_path.glob("*.db.gz"))) == 1
+
+
+@pytest.mark.anyio
+async def test_membership_metrics(
+    async_client: AsyncClient, registered_user: dict, logged_in_token: str, mocker
+):
+    mocker.patch.object(config, "ADMIN_EMAILS", [registered_user["email"]])
+
+    response = await async_client.get(
+        "/admin/membership", headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == 200
+    assert {"estimated_false_positive_rate", "size_bytes"} <= response.json().keys()
+
+
+@pytest.mark.anyio
+async def test_cache_metrics(
+    async_client: AsyncClient, registered_user: dict, logged_in_token: str, mocker
+):
+    mocker.patch.object(config, "ADMIN_EMAILS", [registered_user["email"]])
+
+    response = await async_client.get(
+        "/admin/cache", headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == 200
+    assert {"bytes_saved", "compress_ms"} <= response.json().keys()
+
+
+@pytest.mark.anyio
+async def test_job_metrics(
+    async_client: AsyncClient, registered_user: dict, logged_in_token: str, mocker
+):
+    mocker.patch.object(config, "ADMIN_EMAILS", [registered_user["email"]])
+
+    response = await async_client.get(
+        "/admin/jobs", headers={"Authorization": f"Bearer {logged_in_token}"}
+    )
+
+    assert response.status_code == 200
+    assert {"queue_depth", "latency_avg_ms"} <= response.json().keys()
@@ -2,49 +2,10 @@ import pytest
 from httpx import AsyncClient
 
 from app import security
-
-
-async def create_post(
-    body: str, async_client: AsyncClient, logged_in_token: str
-) -> dict:
-    response = await async_client.post(
-        "/post",
-        json={"body": body},
-        headers={
-            "Authorization": f"Bearer {logged_in_token}"
-        },  # This token is grabbed from the request by security.oauth2_scheme in the controller
-    )
-    return response.json()
-
-
-async def create_comment(
-    body: str, post_id: int, async_client: AsyncClient, logged_in_token: str
-) -> dict:
-    response = await async_client.post(
-        "/comment",
-        json={
-            "body": body,
-            "post_id": post_id,
-        },
-        headers={"Authorization": f"Bearer {logged_in_token}"},
-    )
-    return response.json()
-
-
-@pytest.fixture()
-async def created_post(async_client: AsyncClient, logged_in_token: str):
-    """Fixture of a created post"""
-    return await create_post("Test post", async_client, logged_in_token)
-
-
-@pytest.fixture()
-async def created_comment(
-    async_client: AsyncClient, created_post: dict, logged_in_token: str
-):
-    """Fixture of a created comment"""
-    return await create_comment(
-        "Test comment", created_post["id"], async_client, logged_in_token
-    )
+from app.config import config
+from app.ranking import top_posts
+from app.routers import post as post_router
+from tests.helpers import create_comment, create_post
 
 
 @pytest.mark.anyio  # Telling pytest this test should use the async backend configured in the conftest
@@ -105,6 +66,79 @@ async def test_get_posts(async_client: AsyncClient, created_post: dict):
     assert created_post in response.json()
 
 
+@pytest.mark.anyio
+async def test_get_posts_fields(async_client: AsyncClient, created_post: dict):
+    response = await async_client.get(
+        "/post", params={"fields": "id,user_id", "body_length": 4}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"id": created_post["id"], "user_id": created_post["user_id"]}
+    ]  # Fields that were not requested are left out, not sent as null
+
+
+@pytest.mark.anyio
+async def test_get_posts_body_preview(async_client: AsyncClient, created_post: dict):
+    response = await async_client.get(
+        "/post", params={"fields": "id,body", "body_length": 4}
+    )
+
+    assert response.json() == [{"id": created_post["id"], "body": "Test"}]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("fields", ["id,password", "", ","])
+async def test_get_posts_invalid_fields(async_client: AsyncClient, fields: str):
+    response = await async_client.get("/post", params={"fields": fields})
+
+    assert response.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_get_posts_by_ids(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    other_post = await create_post("Other post", async_client, logged_in_token)
+
+    response = await async_client.get(
+        "/post",
+        params={
+            "ids": f"{other_post['id']},999,{created_post['id']}",
+            "fields": "body",
+        },
+    )
+
+    assert response.status_code == 200
+    assert response.json() == [
+        {"body": "Other post"},
+        {"body": "Test post"},
+    ]  # In the requested order, without the missing post
+
+
+@pytest.mark.anyio
+async def test_get_posts_by_ids_single_query(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str, mocker
+):
+    other_post = await create_post("Other post", async_client, logged_in_token)
+    fetch_all = mocker.spy(post_router, "fetch_all_with_deadline")
+
+    response = await async_client.get(
+        "/post", params={"ids": f"{created_post['id']},{other_post['id']}"}
+    )
+
+    assert response.json() == [created_post, other_post]
+    assert fetch_all.call_count == 1
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("ids", ["1,a", ",".join(str(i) for i in range(101))])
+async def test_get_posts_invalid_ids(async_client: AsyncClient, ids: str):
+    response = await async_client.get("/post", params={"ids": ids})
+
+    assert response.status_code == 422
+
+
 @pytest.mark.anyio
 async def test_create_comment(
     async_client: AsyncClient, created_post, registered_user: dict, logged_in_token: str
@@ -170,3 +204,232 @@ async def test_get_post_with_comments_when_post_doesn_exist(async_client: AsyncC
     response = await async_client.get("/post/0")
 
     assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_create_reply(
+    async_client: AsyncClient, created_post, created_comment, logged_in_token: str
+):
+    response = await async_client.post(
+        "/comment",
+        json={
+            "body": "Test reply",
+            "post_id": created_post["id"],
+            "parent_id": created_comment["id"],
+        },
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 201
+    assert {"parent_id": created_comment["id"]}.items() <= response.json().items()
+
+
+@pytest.mark.anyio
+async def test_create_reply_parent_not_found(
+    async_client: AsyncClient, created_post, logged_in_token: str
+):
+    response = await async_client.post(
+        "/comment",
+        json={"body": "Test reply", "post_id": created_post["id"], "parent_id": 0},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_create_reply_parent_on_another_post(
+    async_client: AsyncClient, created_comment, logged_in_token: str
+):
+    other_post = await create_post("Other post", async_client, logged_in_token)
+    response = await async_client.post(
+        "/comment",
+        json={
+            "body": "Test reply",
+            "post_id": other_post["id"],
+            "parent_id": created_comment["id"],
+        },
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 400
+
+
+@pytest.mark.anyio
+async def test_get_comment_thread(
+    async_client: AsyncClient, created_post, created_comment, logged_in_token: str
+):
+    post_id = created_post["id"]
+    reply = await create_comment(
+        "Reply", post_id, async_client, logged_in_token, created_comment["id"]
+    )
+    nested_reply = await create_comment(
+        "Nested reply", post_id, async_client, logged_in_token, reply["id"]
+    )
+    other = await create_comment(
+        "Other comment", post_id, async_client, logged_in_token
+    )
+
+    response = await async_client.get(f"/post/{post_id}/thread")
+
+    assert response.status_code == 200
+    assert response.json() == {
+        "post_id": post_id,
+        "comments": [
+            {
+                **created_comment,
+                "replies": [
+                    {**reply, "replies": [{**nested_reply, "replies": []}]},
+                ],
+            },
+            {**other, "replies": []},
+        ],
+    }
+
+
+@pytest.mark.anyio
+async def test_get_comment_thread_limits(
+    async_client: AsyncClient, created_post, created_comment, logged_in_token: str
+):
+    post_id = created_post["id"]
+    first_reply = await create_comment(
+        "First reply", post_id, async_client, logged_in_token, created_comment["id"]
+    )
+    second_reply = await create_comment(
+        "Second reply", post_id, async_client, logged_in_token, created_comment["id"]
+    )
+    await create_comment(
+        "Reply to the second reply",
+        post_id,
+        async_client,
+        logged_in_token,
+        second_reply["id"],
+    )  # Dropped with its parent by the breadth limit
+    await create_comment(
+        "Nested reply", post_id, async_client, logged_in_token, first_reply["id"]
+    )  # Dropped by the depth limit
+
+    response = await async_client.get(
+        f"/post/{post_id}/thread", params={"max_depth": 1, "max_replies": 1}
+    )
+
+    assert response.json()["comments"] == [
+        {**created_comment, "replies": [{**first_reply, "replies": []}]}
+    ]
+
+
+@pytest.mark.anyio
+async def test_get_comment_thread_reads_only_shown_replies(
+    async_client: AsyncClient,
+    created_post,
+    created_comment,
+    logged_in_token: str,
+    mocker,
+):
+    post_id = created_post["id"]
+    for i in range(5):
+        reply = await create_comment(
+            f"Reply {i}", post_id, async_client, logged_in_token, created_comment["id"]
+        )
+        await create_comment(
+            "Nested reply", post_id, async_client, logged_in_token, reply["id"]
+        )
+    fetch_all = mocker.spy(post_router, "fetch_all_with_deadline")
+
+    response = await async_client.get(
+        f"/post/{post_id}/thread", params={"max_replies": 2}
+    )
+
+    assert len(response.json()["comments"][0]["replies"]) == 2
+    assert (
+        len(fetch_all.spy_return) == 5
+    )  # The comment, its first 2 replies and their replies. The other 6 comments are not read
+
+
+@pytest.mark.anyio
+async def test_get_comment_thread_post_not_found(async_client: AsyncClient):
+    response = await async_client.get("/post/2/thread")
+
+    assert response.status_code == 404
+
+
+@pytest.mark.anyio
+async def test_get_comment_thread_pagination(
+    async_client: AsyncClient, created_post, created_comment, logged_in_token: str
+):
+    post_id = created_post["id"]
+    second = await create_comment("Second", post_id, async_client, logged_in_token)
+    reply = await create_comment(
+        "Reply", post_id, async_client, logged_in_token, second["id"]
+    )
+    await create_comment("Third", post_id, async_client, logged_in_token)
+
+    response = await async_client.get(
+        f"/post/{post_id}/thread", params={"limit": 1, "offset": 1}
+    )
+
+    assert response.json()["comments"] == [
+        {**second, "replies": [{**reply, "replies": []}]}
+    ]
+
+
+@pytest.mark.anyio
+async def test_create_post_idempotency_key(
+    async_client: AsyncClient, logged_in_token: str
+):
+    headers = {
+        "Authorization": f"Bearer {logged_in_token}",
+        "Idempotency-Key": "post-key",
+    }
+    first = await async_client.post("/post", json={"body": "Test"}, headers=headers)
+    retry = await async_client.post("/post", json={"body": "Test"}, headers=headers)
+
+    assert retry.status_code == 201
+    assert retry.json() == first.json()
+    assert len((await async_client.get("/post")).json()) == 1
+
+
+@pytest.mark.anyio
+async def test_create_comment_idempotency_key(
+    async_client: AsyncClient, created_post, logged_in_token: str
+):
+    headers = {
+        "Authorization": f"Bearer {logged_in_token}",
+        "Idempotency-Key": "comment-key",
+    }
+    comment = {"body": "Test", "post_id": created_post["id"]}
+    first = await async_client.post("/comment", json=comment, headers=headers)
+    retry = await async_client.post("/comment", json=comment, headers=headers)
+    other = await async_client.post(
+        "/comment", json={**comment, "body": "Other"}, headers=headers
+    )
+
+    assert retry.json() == first.json()
+    assert other.status_code == 422
+    response = await async_client.get(f"/post/{created_post['id']}/comments")
+    assert len(response.json()) == 1
+
+
+@pytest.mark.anyio
+async def test_get_top_posts(
+    async_client: AsyncClient, created_post, logged_in_token: str
+):
+    other_post = await create_post("Other post", async_client, logged_in_token)
+    for _ in range(2):
+        await create_comment("Comment", other_post["id"], async_client, logged_in_token)
+    await create_comment("Comment", created_post["id"], async_client, logged_in_token)
+
+    response = await async_client.get("/post/top", params={"limit": 1})
+
+    assert response.status_code == 200
+    assert [post["post_id"] for post in response.json()] == [other_post["id"]]
+    assert await top_posts.check_consistency()
+
+
+@pytest.mark.anyio
+async def test_get_top_posts_limit_above_capacity(async_client: AsyncClient):
+    response = await async_client.get(
+        "/post/top", params={"limit": config.TOP_POSTS_CAPACITY + 1}
+    )
+
+    assert response.status_code == 422
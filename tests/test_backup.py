@@ -0,0 +1,97 @@
+import gzip
+import hashlib
+import sqlite3
+
+import pytest
+
+from app import backup
+
+
+@pytest.fixture()
+def source_database(tmp_path) -> str:
+    path = str(tmp_path / "source.db")
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute("CREATE TABLE posts (id INTEGER PRIMARY KEY, body TEXT)")
+        connection.executemany(
+            "INSERT INTO posts (body) VALUES (?)", [("x" * 500,)] * 1000
+        )  # Several hundred pages, so the copy takes many steps
+    connection.close()
+    return path
+
+
+def count_posts(path: str) -> int:
+    connection = sqlite3.connect(path)
+    try:
+        return connection.execute("SELECT count(*) FROM posts").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_database_path():
+    assert backup.database_path("sqlite:///data/app.db") == "data/app.db"
+    with pytest.raises(ValueError):
+        backup.database_path("sqlite://")
+    with pytest.raises(ValueError):
+        backup.database_path("postgresql://localhost/app")
+
+
+@pytest.mark.anyio
+async def test_snapshot_and_restore(source_database: str, tmp_path, mocker):
+    mocker.patch.object(backup.config, "BACKUP_PAGES_PER_STEP", 10)
+    snapshot = await backup.create_snapshot(source_database, str(tmp_path / "backups"))
+
+    assert snapshot.path.endswith(".db.gz")
+    assert snapshot.pages > 10
+    assert snapshot.size < snapshot.pages * 4096  # Compressed
+    with open(f"{snapshot.path}.sha256") as checksum:
+        assert checksum.read().split()[0] == snapshot.sha256
+    assert list((tmp_path / "backups").glob("*.db")) == []  # Uncompressed copy removed
+
+    target = str(tmp_path / "restored.db")
+    backup.restore_snapshot(snapshot.path, target)
+    assert count_posts(target) == 1000
+
+
+@pytest.mark.anyio
+async def test_restore_corrupted_snapshot(source_database: str, tmp_path):
+    snapshot = await backup.create_snapshot(source_database, str(tmp_path))
+    with open(snapshot.path, "r+b") as file:
+        file.seek(20)
+        file.write(b"corrupted")
+
+    with pytest.raises(ValueError):
+        backup.restore_snapshot(snapshot.path, str(tmp_path / "restored.db"))
+
+
+@pytest.mark.anyio
+async def test_restore_checks_integrity(tmp_path):
+    path = str(tmp_path / "snapshot.db.gz")
+    with gzip.open(path, "wb") as file:
+        file.write(b"not a database" * 100)
+    with open(path, "rb") as file:
+        digest = hashlib.sha256(file.read()).hexdigest()
+    with open(f"{path}.sha256", "w") as checksum:
+        checksum.write(f"{digest}  snapshot.db.gz\n")
+
+    with pytest.raises(sqlite3.DatabaseError):
+        backup.restore_snapshot(path, str(tmp_path / "restored.db"))
+
+
+@pytest.mark.anyio
+async def test_snapshot_with_concurrent_writes(source_database: str, tmp_path, mocker):
+    writer = sqlite3.connect(source_database, check_same_thread=False)
+
+    def write_between_steps(seconds: float) -> None:
+        with writer:
+            writer.execute("INSERT INTO posts (body) VALUES ('new')")
+
+    mocker.patch.object(backup.config, "BACKUP_PAGES_PER_STEP", 10)
+    mocker.patch("app.backup.time.sleep", side_effect=write_between_steps)
+    snapshot = await backup.create_snapshot(source_database, str(tmp_path))
+    writer.close()
+
+    assert snapshot.restarts == backup.config.BACKUP_MAX_RESTARTS
+    target = str(tmp_path / "restored.db")
+    backup.restore_snapshot(snapshot.path, target)
+    assert count_posts(target) == count_posts(source_database)
@@ -0,0 +1,142 @@
+import gzip
+
+import pytest
+from fastapi import Request
+from httpx import AsyncClient
+from pydantic import TypeAdapter
+
+from app.compression import ResponseCache, negotiate, response_cache
+from app.config import config
+from app.routers import post as post_router
+from tests.helpers import create_comment, create_post
+
+
+def make_request(accept_encoding: str = "gzip") -> Request:
+    return Request(
+        {
+            "type": "http",
+            "path": "/api/items",
+            "query_string": b"",
+            "headers": [(b"accept-encoding", accept_encoding.encode())],
+        }
+    )
+
+
+@pytest.mark.parametrize(
+    "accept_encoding, expected",
+    [
+        ("gzip", "gzip"),
+        ("gzip, deflate, br", "br"),
+        ("br;q=0.5, gzip;q=1", "gzip"),
+        ("gzip;q=0", None),
+        ("identity", None),
+        ("*", "br"),
+        ("", None),
+    ],
+)
+def test_negotiate(accept_encoding: str, expected: str | None):
+    assert negotiate(accept_encoding) == expected
+
+
+@pytest.mark.anyio
+async def test_small_body_not_compressed(async_client: AsyncClient, created_post: dict):
+    response = await async_client.get("/post", headers={"Accept-Encoding": "gzip"})
+
+    assert "content-encoding" not in response.headers
+    assert response.json() == [created_post]
+
+
+@pytest.mark.anyio
+async def test_compressed_once_and_cached(
+    async_client: AsyncClient, created_post: dict, mocker
+):
+    mocker.patch.object(config, "COMPRESSION_MIN_SIZE", 0)
+    fetch_all = mocker.spy(post_router, "fetch_all_with_deadline")
+
+    for _ in range(3):
+        response = await async_client.get("/post", headers={"Accept-Encoding": "gzip"})
+        assert response.headers["content-encoding"] == "gzip"
+        assert response.headers["vary"] == "Accept-Encoding"
+        assert response.json() == [created_post]  # Decompressed by httpx
+
+    assert fetch_all.call_count == 1
+    metrics = response_cache.metrics()
+    assert (metrics["hits"], metrics["misses"], metrics["compressions"]) == (2, 1, 1)
+
+
+@pytest.mark.anyio
+async def test_brotli_preferred(async_client: AsyncClient, created_post: dict, mocker):
+    mocker.patch.object(config, "COMPRESSION_MIN_SIZE", 0)
+
+    response = await async_client.get("/post", headers={"Accept-Encoding": "gzip, br"})
+
+    assert response.headers["content-encoding"] == "br"
+    assert response.json() == [created_post]
+
+
+@pytest.mark.anyio
+async def test_cache_keyed_by_query(async_client: AsyncClient, created_post: dict):
+    response = await async_client.get("/post", params={"fields": "id"})
+    assert response.json() == [{"id": created_post["id"]}]
+
+    response = await async_client.get("/post")
+    assert response.json() == [created_post]
+
+
+@pytest.mark.anyio
+async def test_post_write_invalidates(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    await async_client.get("/post")
+    other_post = await create_post("Other post", async_client, logged_in_token)
+
+    response = await async_client.get("/post")
+
+    assert response.json() == [created_post, other_post]
+
+
+@pytest.mark.anyio
+async def test_comment_write_invalidates(
+    async_client: AsyncClient, created_post: dict, logged_in_token: str
+):
+    url = f"/post/{created_post['id']}/comments"
+    assert (await async_client.get(url)).json() == []
+    comment = await create_comment(
+        "Test comment", created_post["id"], async_client, logged_in_token
+    )
+
+    response = await async_client.get(url)
+
+    assert response.json() == [comment]
+
+
+@pytest.mark.anyio
+async def test_write_while_loading_not_cached():
+    cache = ResponseCache()
+    adapter = TypeAdapter(list[int])
+    loads = []
+
+    async def load():
+        loads.append(1)
+        cache.invalidate("items")  # A write committed while the query ran
+        return [1]
+
+    await cache.respond(make_request(), "items", load, adapter)
+    await cache.respond(make_request(), "items", load, adapter)
+
+    assert len(loads) == 2
+
+
+@pytest.mark.anyio
+async def test_entries_expire():
+    cache = ResponseCache(ttl=0)
+    adapter = TypeAdapter(list[int])
+
+    async def load():
+        return list(range(1000))
+
+    await cache.respond(make_request(), "items", load, adapter)
+    response = await cache.respond(make_request(), "items", load, adapter)
+
+    assert cache.metrics()["misses"] == 2
+    assert gzip.decompress(response.body) == adapter.dump_json(list(range(1000)))
@@ -0,0 +1,60 @@
+import sqlite3
+
+import pytest
+import sqlalchemy
+
+from app.database import (
+    CREATED_AT_MIGRATION,
+    PARENT_ID_MIGRATION,
+    check_schema,
+    engine,
+    metadata,
+)
+
+
+@pytest.fixture()
+def old_database(tmp_path):
+    """Path of a database whose comments table was created before the replies and the ranking"""
+    path = tmp_path / "old.db"
+    metadata.create_all(sqlalchemy.create_engine(f"sqlite:///{path}"))
+    connection = sqlite3.connect(path)
+    connection.executescript(
+        """
+        DROP TABLE comments;
+        CREATE TABLE comments (
+            id INTEGER PRIMARY KEY,
+            body VARCHAR,
+            post_id INTEGER NOT NULL REFERENCES posts(id),
+            user_id INTEGER NOT NULL REFERENCES users(id)
+        );
+        INSERT INTO comments (body, post_id, user_id) VALUES ('Old', 1, 1);
+        """
+    )
+    yield path, connection
+    connection.close()
+
+
+def test_check_schema():
+    check_schema(engine)
+
+
+def test_check_schema_on_old_database(old_database):
+    path, connection = old_database
+    bind = sqlalchemy.create_engine(f"sqlite:///{path}")
+
+    with pytest.raises(RuntimeError, match="ALTER TABLE comments ADD COLUMN parent_id"):
+        check_schema(bind)
+
+    connection.executescript(PARENT_ID_MIGRATION)
+
+    with pytest.raises(
+        RuntimeError, match="ALTER TABLE comments ADD COLUMN created_at"
+    ):
+        check_schema(bind)
+
+    connection.executescript(CREATED_AT_MIGRATION)
+
+    check_schema(bind)
+    assert connection.execute(
+        "SELECT parent_id, created_at FROM comments"
+    ).fetchall() == [(None, "1970-01-01 00:00:00")]
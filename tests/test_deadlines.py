@@ -0,0 +1,134 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from httpx import AsyncClient
+from sqlalchemy import text
+
+from app.config import config
+from app.database import database
+from app.deadlines import fetch_all_with_deadline, route_deadline
+from app.main import app
+from app.routers import post as post_router
+
+SLOW_QUERY = """
+    WITH RECURSIVE counter(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM counter WHERE x < 1000000000)
+    SELECT count(*) FROM counter
+"""  # Keeps SQLite busy for minutes
+
+
+class FakeRequest:
+    """Request of the route "route_name" whose client disconnects after "disconnect_after" seconds"""
+
+    def __init__(
+        self, route_name: str = "test_route", disconnect_after: float | None = None
+    ) -> None:
+        self.scope = {"route": SimpleNamespace(name=route_name)}
+        self.disconnect_at = (
+            None if disconnect_after is None else time.monotonic() + disconnect_after
+        )
+
+    async def is_disconnected(self) -> bool:
+        return self.disconnect_at is not None and time.monotonic() >= self.disconnect_at
+
+
+async def assert_database_is_free():
+    """The tests share a single connection, so this query would wait for any statement still running"""
+    start = time.monotonic()
+    assert await asyncio.wait_for(database.fetch_val("SELECT 1"), 5) == 1
+    assert time.monotonic() - start < 0.5
+
+
+def test_route_deadline(mocker):
+    mocker.patch.object(config, "DB_DEADLINE_SECONDS", 10.0)
+    mocker.patch.object(config, "DB_ROUTE_DEADLINES", {"get_all_posts": 2.0})
+
+    assert route_deadline(FakeRequest("get_all_posts")) == 2.0
+    assert route_deadline(FakeRequest("get_comments_on_post")) == 10.0
+
+
+@pytest.mark.anyio
+async def test_fast_query_returns_rows():
+    rows = await fetch_all_with_deadline("SELECT 1 AS one", FakeRequest())
+    assert rows[0].one == 1
+
+
+@pytest.mark.anyio
+async def test_query_interrupted_at_deadline(mocker):
+    mocker.patch.object(config, "DB_ROUTE_DEADLINES", {"slow_route": 0.2})
+    start = time.monotonic()
+
+    with pytest.raises(HTTPException) as exc_info:
+        await asyncio.wait_for(
+            fetch_all_with_deadline(SLOW_QUERY, FakeRequest("slow_route")), 5
+        )
+
+    assert exc_info.value.status_code == 504
+    assert time.monotonic() - start < 2
+    await assert_database_is_free()
+
+
+@pytest.mark.anyio
+async def test_query_interrupted_on_disconnect():
+    start = time.monotonic()
+
+    with pytest.raises(HTTPException) as exc_info:
+        await asyncio.wait_for(
+            fetch_all_with_deadline(SLOW_QUERY, FakeRequest(disconnect_after=0.2)), 5
+        )
+
+    assert exc_info.value.status_code == 499
+    assert time.monotonic() - start < 2
+    await assert_database_is_free()
+
+
+@pytest.mark.anyio
+async def test_route_deadline_end_to_end(async_client: AsyncClient, mocker):
+    mocker.patch.object(config, "DB_ROUTE_DEADLINES", {"get_all_posts": 0.2})
+    mocker.patch.object(post_router, "posts_query", return_value=text(SLOW_QUERY))
+    start = time.monotonic()
+
+    response = await asyncio.wait_for(async_client.get("/post"), 5)
+
+    assert response.status_code == 504
+    assert time.monotonic() - start < 2
+    await assert_database_is_free()
+
+
+@pytest.mark.anyio
+async def test_route_disconnect_end_to_end(mocker):
+    mocker.patch.object(post_router, "posts_query", return_value=text(SLOW_QUERY))
+    disconnect_at = time.monotonic() + 0.2
+    sent = []
+
+    async def receive():
+        # Starlette polls for a disconnect by cancelling this call right away, so it must not wait once the client left
+        if time.monotonic() < disconnect_at:
+            await asyncio.sleep(disconnect_at - time.monotonic())
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": "/api/post",
+        "raw_path": b"/api/post",
+        "query_string": b"",
+        "headers": [(b"host", b"testserver")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("testserver", 80),
+    }
+    start = time.monotonic()
+
+    await asyncio.wait_for(app(scope, receive, send), 5)
+
+    assert sent[0]["status"] == 499
+    assert time.monotonic() - start < 2
+    await assert_database_is_free()
@@ -0,0 +1,124 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.idempotency import IdempotencyStore
+
+
+class Counter:
+    """Stands in for an insert, returning a new id every time it is called"""
+
+    def __init__(self, delay: float = 0) -> None:
+        self.calls = 0
+        self.delay = delay
+
+    async def __call__(self) -> dict:
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return {"id": self.calls}
+
+
+@pytest.mark.anyio
+async def test_replays_stored_response():
+    store = IdempotencyStore()
+    create = Counter()
+
+    first = await store.run(1, "key", "request", create)
+    second = await store.run(1, "key", "request", create)
+
+    assert first == second == {"id": 1}
+    assert create.calls == 1
+
+
+@pytest.mark.anyio
+async def test_keys_are_scoped_by_user():
+    store = IdempotencyStore()
+    create = Counter()
+
+    await store.run(1, "key", "request", create)
+    await store.run(2, "key", "request", create)
+
+    assert create.calls == 2
+
+
+@pytest.mark.anyio
+async def test_no_key_always_creates():
+    store = IdempotencyStore()
+    create = Counter()
+
+    await store.run(1, None, "request", create)
+    await store.run(1, None, "request", create)
+
+    assert create.calls == 2
+
+
+@pytest.mark.anyio
+async def test_key_reused_for_another_request():
+    store = IdempotencyStore()
+    await store.run(1, "key", "request", Counter())
+
+    with pytest.raises(HTTPException) as exc_info:
+        await store.run(1, "key", "another request", Counter())
+    assert exc_info.value.status_code == 422
+
+
+@pytest.mark.anyio
+async def test_concurrent_retries_wait_for_the_original():
+    store = IdempotencyStore()
+    create = Counter(delay=0.05)
+
+    results = await asyncio.gather(
+        *(store.run(1, "key", "request", create) for _ in range(5))
+    )
+
+    assert results == [{"id": 1}] * 5
+    assert create.calls == 1
+
+
+@pytest.mark.anyio
+async def test_failed_request_is_not_stored():
+    store = IdempotencyStore()
+
+    async def fail() -> dict:
+        raise HTTPException(status_code=404)
+
+    with pytest.raises(HTTPException):
+        await store.run(1, "key", "request", fail)
+    assert await store.run(1, "key", "request", Counter()) == {"id": 1}
+
+
+@pytest.mark.anyio
+async def test_expired_key_creates_again():
+    store = IdempotencyStore(ttl=0)
+    create = Counter()
+
+    await store.run(1, "key", "request", create)
+    await store.run(1, "key", "request", create)
+
+    assert create.calls == 2
+
+
+@pytest.mark.anyio
+async def test_oldest_keys_are_evicted():
+    store = IdempotencyStore(max_keys=1)
+    create = Counter()
+
+    await store.run(1, "first", "request", create)
+    await store.run(1, "second", "request", create)
+    await store.run(1, "first", "request", create)
+
+    assert create.calls == 3
+
+
+@pytest.mark.anyio
+async def test_persisted_response_survives_memory_loss():
+    store = IdempotencyStore(persist=True)
+    create = Counter()
+
+    await store.run(1, "key", "request", create)
+    store.clear()  # As after a restart
+    response = await store.run(1, "key", "request", create)
+
+    assert response == {"id": 1}
+    assert create.calls == 1
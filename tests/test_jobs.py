@@ -0,0 +1,186 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from app.database import database, jobs_table
+from app.jobs import Job, JobQueue
+
+
+@pytest.fixture()
+async def job_queue():
+    queue = JobQueue(maxsize=10, workers=2, max_retries=2, retry_backoff=0.01)
+    yield queue
+    await queue.stop(timeout=1)
+
+
+@pytest.mark.anyio
+async def test_enqueued_job_runs(job_queue: JobQueue):
+    calls = []
+
+    @job_queue.register("record")
+    async def record(value: int):
+        calls.append(value)
+
+    await job_queue.start()
+    await job_queue.enqueue("record", value=1)
+    await job_queue.enqueue("record", value=2)
+    await job_queue.join()
+
+    assert sorted(calls) == [1, 2]
+    assert {
+        "completed": 2,
+        "failed": 0,
+        "queue_depth": 0,
+    }.items() <= job_queue.metrics().items()
+
+
+@pytest.mark.anyio
+async def test_failing_job_is_retried(job_queue: JobQueue):
+    attempts = []
+
+    @job_queue.register("flaky")
+    async def flaky():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise RuntimeError("Temporary failure")
+
+    await job_queue.start()
+    await job_queue.enqueue("flaky")
+    await job_queue.join()
+
+    assert len(attempts) == 2
+    assert {"completed": 1, "retried": 1}.items() <= job_queue.metrics().items()
+
+
+@pytest.mark.anyio
+async def test_job_dropped_after_max_retries(job_queue: JobQueue):
+    attempts = []
+
+    @job_queue.register("broken")
+    async def broken():
+        attempts.append(1)
+        raise RuntimeError("Permanent failure")
+
+    await job_queue.start()
+    await job_queue.enqueue("broken")
+    await job_queue.join()
+
+    assert len(attempts) == 3  # First attempt plus "max_retries"
+    assert {"completed": 0, "failed": 1}.items() <= job_queue.metrics().items()
+
+
+@pytest.mark.anyio
+async def test_enqueue_unknown_job(job_queue: JobQueue):
+    await job_queue.start()
+    with pytest.raises(ValueError):
+        await job_queue.enqueue("unknown")
+
+
+@pytest.mark.anyio
+async def test_enqueue_when_not_running(job_queue: JobQueue):
+    @job_queue.register("record")
+    async def record():
+        pass
+
+    with pytest.raises(RuntimeError):
+        await job_queue.enqueue("record")
+
+
+@pytest.mark.anyio
+async def test_persisted_jobs_run_on_start():
+    calls = []
+    queue = JobQueue(persist=True, retry_backoff=0.01)
+
+    @queue.register("record")
+    async def record(value: int):
+        calls.append(value)
+
+    await database.execute(
+        jobs_table.insert().values(
+            name="record", payload=json.dumps({"value": 1}), created_at=time.time()
+        )
+    )  # Simulates a job left pending by a previous run
+    await queue.start()
+    await queue.enqueue("record", value=2)
+    await queue.join()
+    await queue.stop(timeout=1)
+
+    assert sorted(calls) == [1, 2]
+    assert await database.fetch_all(jobs_table.select()) == []
+
+
+@pytest.mark.anyio
+async def test_persisted_jobs_claimed_once():
+    calls = []
+    queue = JobQueue(persist=True, lease=0.3)
+
+    @queue.register("record")
+    async def record(value: int):
+        calls.append(value)
+
+    for value, claimed_at in ((1, time.time()), (2, time.time() - 10)):
+        await database.execute(
+            jobs_table.insert().values(
+                name="record",
+                payload=json.dumps({"value": value}),
+                created_at=time.time(),
+                claimed_by="other-process",
+                claimed_at=claimed_at,
+            )
+        )  # The first one belongs to a live process, the second one to a process that stopped
+    await queue.start()
+    await queue.join()
+
+    assert calls == [2]
+
+    await asyncio.sleep(0.5)  # The other process did not renew its claim in time
+    await queue.join()
+    await queue.stop(timeout=1)
+
+    assert calls == [2, 1]
+    assert await database.fetch_all(jobs_table.select()) == []
+
+
+@pytest.mark.anyio
+async def test_stop_releases_claimed_jobs():
+    queue = JobQueue(persist=True, workers=1)
+    release = asyncio.Event()
+
+    @queue.register("wait")
+    async def wait():
+        await release.wait()
+
+    await queue.start()
+    await queue.enqueue("wait")
+    await queue.stop(timeout=0.05)
+
+    (row,) = await database.fetch_all(jobs_table.select())
+    assert row.claimed_by is None  # Taken right away by the next process to start
+
+
+@pytest.mark.anyio
+async def test_claim_releases_jobs_that_do_not_fit(mocker):
+    queue = JobQueue(persist=True, maxsize=2)
+    queue._queue = asyncio.Queue(maxsize=2)  # No workers, so nothing leaves the queue
+    for value in range(3):
+        await database.execute(
+            jobs_table.insert().values(
+                name="record", payload=json.dumps({"value": value}), created_at=0
+            )
+        )
+    fetch_all = database.fetch_all
+
+    async def fetch_all_and_enqueue(query):
+        rows = await fetch_all(query)
+        queue._queue.put_nowait(Job(name="record", kwargs={}))  # Enqueued meanwhile
+        return rows
+
+    mocker.patch.object(database, "fetch_all", fetch_all_and_enqueue)
+    await asyncio.wait_for(queue._claim_jobs(), 1)  # Does not wait for a free slot
+
+    rows = await fetch_all(jobs_table.select().order_by(jobs_table.c.id))
+    assert [row.claimed_by for row in rows] == [queue.owner, None, None]
+    assert queue._claimed == {rows[0].id}
+    assert queue._queue.qsize() == 2
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+from app import loaders, security
+from app.database import database
+from app.loaders import BatchLoader
+
+
+class FakeBatch:
+    """Batch function over squares, recording the keys of every call"""
+
+    def __init__(self) -> None:
+        self.calls: list[list[int]] = []
+
+    async def __call__(self, keys: list[int]) -> dict:
+        self.calls.append(keys)
+        return {key: key * key for key in keys if key >= 0}
+
+
+@pytest.mark.anyio
+async def test_concurrent_loads_share_a_batch():
+    batch = FakeBatch()
+    loader = BatchLoader("square", batch)
+
+    results = await asyncio.gather(*(loader.load(key) for key in [1, 2, 2, -1]))
+
+    assert results == [1, 4, 4, None]
+    assert batch.calls == [[1, 2, -1]]
+
+
+@pytest.mark.anyio
+async def test_sequential_loads_use_separate_batches():
+    batch = FakeBatch()
+    loader = BatchLoader("square", batch)
+
+    assert await loader.load(2) == 4
+    assert await loader.load(3) == 9
+    assert batch.calls == [[2], [3]]
+
+
+@pytest.mark.anyio
+async def test_big_batches_are_split():
+    batch = FakeBatch()
+    loader = BatchLoader("square", batch, max_batch_size=2)
+
+    await asyncio.gather(*(loader.load(key) for key in range(5)))
+
+    assert batch.calls == [[0, 1], [2, 3], [4]]
+
+
+@pytest.mark.anyio
+async def test_batch_error_reaches_every_caller():
+    async def fail(keys):
+        raise RuntimeError("Database is down")
+
+    loader = BatchLoader("failing", fail)
+    results = await asyncio.gather(
+        loader.load(1), loader.load(2), return_exceptions=True
+    )
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+@pytest.mark.anyio
+async def test_request_memo():
+    batch = FakeBatch()
+    loader = BatchLoader("square", batch)
+    token = loaders._request_memo.set({})
+    try:
+        await loader.load(2)
+        await loader.load(2)
+        await loader.load(-1)
+        await loader.load(-1)  # Misses are looked up again
+    finally:
+        loaders._request_memo.reset(token)
+
+    assert batch.calls == [[2], [-1], [-1]]
+
+
+@pytest.mark.anyio
+async def test_concurrent_get_user_is_one_query(registered_user: dict, mocker):
+    spy = mocker.spy(database, "fetch_all")
+
+    users = await asyncio.gather(
+        security.get_user(registered_user["email"]),
+        security.get_user("missing@example.net"),
+        security.get_user(registered_user["email"]),
+    )
+
+    assert [user.email if user else None for user in users] == [
+        registered_user["email"],
+        None,
+        registered_user["email"],
+    ]
+    assert spy.call_count == 1
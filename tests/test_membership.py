@@ -0,0 +1,163 @@
+import asyncio
+
+import pytest
+from httpx import AsyncClient
+
+from app import security
+from app.config import config
+from app.database import database, user_table
+from app.membership import BloomFilter, registered_emails
+
+
+def test_bloom_filter_false_positive_rate():
+    bloom = BloomFilter(capacity=1000, false_positive_rate=0.01)
+    for i in range(1000):
+        bloom.add(f"user{i}@example.net")
+
+    assert all(f"user{i}@example.net" in bloom for i in range(1000))
+    false_positives = sum(f"other{i}@example.net" in bloom for i in range(10000))
+    assert false_positives / 10000 < 0.02
+    assert bloom.estimated_false_positive_rate() == pytest.approx(0.01, rel=0.2)
+    assert bloom.size < 1300  # About 9.6 bits per email
+
+
+@pytest.mark.anyio
+async def test_might_exist_before_build():
+    assert await registered_emails.might_exist("test@example.net")
+
+
+@pytest.mark.anyio
+async def test_build(registered_user: dict):
+    await registered_emails.build()
+
+    assert await registered_emails.might_exist(registered_user["email"])
+    assert not await registered_emails.might_exist("missing@example.net")
+    metrics = registered_emails.metrics()
+    assert metrics["items"] == 1
+    assert metrics["skipped_queries"] == 1
+    assert metrics["size_bytes"] > 0
+
+
+@pytest.mark.anyio
+async def test_login_unknown_email_skips_query(async_client: AsyncClient, mocker):
+    await registered_emails.build()
+    load = mocker.spy(security.user_loader, "load")
+
+    response = await async_client.post(
+        "/login", json={"email": "missing@example.net", "password": "1234"}
+    )
+
+    assert response.status_code == 401
+    assert load.call_count == 0
+
+
+@pytest.mark.anyio
+async def test_register_adds_email(async_client: AsyncClient):
+    await registered_emails.build()
+    user = {"email": "new@example.net", "password": "1234"}
+
+    await async_client.post("/register", json=user)
+    response = await async_client.post("/login", json=user)
+
+    assert response.status_code == 201
+
+
+@pytest.mark.anyio
+async def test_register_duplicate_missed_by_filter(
+    async_client: AsyncClient, registered_user: dict, mocker
+):
+    mocker.patch.object(registered_emails, "might_exist", return_value=False)
+
+    response = await async_client.post("/register", json=registered_user)
+
+    assert response.status_code == 400  # Caught by the unique email column instead
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("shared", [True, False])
+async def test_user_registered_by_another_worker(mocker, shared: bool):
+    mocker.patch.object(config, "MEMBERSHIP_SHARED_DATABASE", shared)
+    await registered_emails.build()
+    await database.execute(
+        user_table.insert().values(email="other@example.net", password="x")
+    )  # Written to the database directly, as another worker would
+
+    assert await registered_emails.might_exist("other@example.net") is shared
+
+
+@pytest.mark.anyio
+async def test_concurrent_misses_share_sync(mocker):
+    mocker.patch.object(config, "MEMBERSHIP_SHARED_DATABASE", True)
+    await registered_emails.build()
+
+    results = await asyncio.gather(
+        *(registered_emails.might_exist(f"missing{i}@example.net") for i in range(20))
+    )
+
+    assert not any(results)
+    assert registered_emails.metrics()["syncs"] == 1
+
+
+@pytest.mark.anyio
+async def test_filter_grows_when_full(async_client: AsyncClient, mocker):
+    mocker.patch.object(config, "MEMBERSHIP_MIN_CAPACITY", 1)
+    await registered_emails.build()
+    for i in range(3):
+        await async_client.post(
+            "/register", json={"email": f"user{i}@example.net", "password": "1234"}
+        )
+    if registered_emails._growing:
+        await registered_emails._growing
+
+    metrics = registered_emails.metrics()
+    assert metrics["items"] == 3
+    assert metrics["capacity"] > 3  # Rebuilt for twice the users registered then
+    assert all(
+        [await registered_emails.might_exist(f"user{i}@example.net") for i in range(3)]
+    )
+
+
+@pytest.mark.anyio
+async def test_rebuild_keeps_users_loaded_meanwhile(mocker):
+    mocker.patch.object(config, "MEMBERSHIP_SHARED_DATABASE", True)
+    await registered_emails.build()
+    fetch_all = database.fetch_all
+    rebuild_loaded = asyncio.Event()
+    release = asyncio.Event()
+
+    async def slow_full_load(query, *args, **kwargs):
+        rows = await fetch_all(query, *args, **kwargs)
+        if "WHERE" not in str(query):
+            rebuild_loaded.set()
+            await release.wait()
+        return rows
+
+    mocker.patch.object(database, "fetch_all", side_effect=slow_full_load)
+    rebuild = asyncio.create_task(registered_emails.build())
+    await rebuild_loaded.wait()
+    await database.execute(
+        user_table.insert().values(email="late@example.net", password="x")
+    )  # Registered by another worker after the rebuild read the users
+    check = asyncio.create_task(registered_emails.might_exist("late@example.net"))
+    await asyncio.sleep(0.01)
+    release.set()
+    await rebuild
+
+    assert await check
+    assert await registered_emails.might_exist("late@example.net")
+
+
+@pytest.mark.anyio
+async def test_filter_grows_when_full_after_sync(mocker):
+    mocker.patch.object(config, "MEMBERSHIP_SHARED_DATABASE", True)
+    mocker.patch.object(config, "MEMBERSHIP_MIN_CAPACITY", 1)
+    await registered_emails.build()
+    for i in range(2):
+        await database.execute(
+            user_table.insert().values(email=f"user{i}@example.net", password="x")
+        )  # Registered by another worker, this one only serves logins
+
+    await registered_emails.might_exist("missing@example.net")
+    await registered_emails._growing
+
+    assert registered_emails.metrics()["capacity"] == 4
@@ -0,0 +1,83 @@
+import random
+
+import pytest
+
+from app.database import comments_table, database, post_table
+from app.ranking import TopPosts, from_timestamp
+
+DAY = 24 * 60 * 60
+
+
+def test_more_comments_rank_higher():
+    ranking = TopPosts(half_life=DAY)
+    ranking.clear(epoch=0)
+    ranking.add(1, 0)
+    ranking.add(2, 0)
+    ranking.add(2, 0)
+
+    assert ranking.top(10, now=0) == [(2, 2.0), (1, 1.0)]
+
+
+def test_scores_decay():
+    ranking = TopPosts(half_life=DAY)
+    ranking.clear(epoch=0)
+    ranking.add(1, 0)
+    ranking.add(1, 0)
+    ranking.add(1, 0)
+    ranking.add(2, DAY)
+    ranking.add(2, DAY)  # Two comments one day later outweigh three older ones
+
+    assert ranking.top(2, now=2 * DAY) == [(2, 1.0), (1, 0.75)]
+
+
+def test_matches_brute_force_with_small_capacity():
+    rng = random.Random(0)
+    ranking = TopPosts(half_life=DAY, capacity=5)
+    ranking.clear(epoch=0)
+    scores: dict[int, float] = {}
+    for i in range(2000):
+        post_id, at = rng.randrange(50), i * 60
+        ranking.add(post_id, at)
+        scores[post_id] = scores.get(post_id, 0.0) + 2 ** (at / DAY)
+
+    expected = sorted(scores, key=scores.get, reverse=True)[:5]
+    assert [post_id for post_id, _ in ranking.top(5, now=0)] == expected
+
+
+def test_rescale_keeps_the_order():
+    ranking = TopPosts(half_life=1)
+    ranking.clear(epoch=0)
+    ranking.add(1, 0)
+    ranking.add(1, 0)
+    ranking.add(2, 0)
+    ranking.add(3, 600)  # Past the exponent limit, forces a rescale
+
+    assert [post_id for post_id, _ in ranking.top(3, now=600)] == [3, 1, 2]
+
+
+@pytest.mark.anyio
+async def test_rebuild_and_consistency(registered_user: dict, mocker):
+    for post_id in (1, 2):
+        await database.execute(
+            post_table.insert().values(
+                id=post_id, body="", user_id=registered_user["id"]
+            )
+        )
+    for post_id, created_at in ((1, 1000.0), (2, 2000.0), (2, 3000.0)):
+        await database.execute(
+            comments_table.insert().values(
+                body="",
+                post_id=post_id,
+                user_id=registered_user["id"],
+                created_at=from_timestamp(created_at),
+            )
+        )
+    mocker.patch("app.ranking.time.time", return_value=3000.0)
+    ranking = TopPosts(half_life=1000)
+
+    await ranking.rebuild()
+
+    assert ranking.top(2) == [(2, 1.5), (1, 0.25)]
+    assert await ranking.check_consistency()
+    ranking.add(1, 3000.0)  # A comment the database does not have
+    assert not await ranking.check_consistency()
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import logging
+import time
+
+import pytest
+from httpx import AsyncClient
+
+from app import tracing
+from app.config import config
+
+
+def exported_traces(caplog) -> list[dict]:
+    return [
+        json.loads(record.getMessage())
+        for record in caplog.records
+        if record.name == "app.tracing.export"
+    ]
+
+
+def test_span_outside_of_a_trace():
+    with tracing.span("noop"):
+        pass  # Must not fail when there is no request being traced
+
+
+@pytest.mark.anyio
+async def test_request_spans_are_exported(
+    async_client: AsyncClient, logged_in_token: str, caplog, mocker
+):
+    mocker.patch.object(config, "TRACING_ENABLED", True)
+    caplog.set_level(logging.INFO, logger="app.tracing.export")
+
+    response = await async_client.post(
+        "/post",
+        json={"body": "Test Post"},
+        headers={"Authorization": f"Bearer {logged_in_token}"},
+    )
+
+    assert response.status_code == 201
+    trace = exported_traces(caplog)[-1]
+    assert {"method": "POST", "path": "/api/post", "status_code": 201}.items() <= (
+        trace.items()
+    )
+    spans = {span["name"]: span for span in trace["spans"]}
+    assert {
+        "middleware",
+        "dependency.get_current_user",
+        "jwt.decode",
+        "loader.user",
+        "db.fetch_all",
+        "db.execute",
+        "serialize",
+    } <= spans.keys()
+    assert trace["spans"][spans["jwt.decode"]["parent"]]["name"] == (
+        "dependency.get_current_user"
+    )  # Spans are nested under the span that was open when they started
+
+
+@pytest.mark.anyio
+async def test_no_trace_when_disabled(async_client: AsyncClient, caplog):
+    caplog.set_level(logging.INFO, logger="app.tracing.export")
+    await async_client.get("/post")
+    assert exported_traces(caplog) == []
+
+
+@pytest.mark.anyio
+async def test_profile_with_debug_header(async_client: AsyncClient, tmp_path, mocker):
+    mocker.patch.object(config, "PROFILE_TOKEN", "secret")
+    mocker.patch.object(config, "PROFILE_DIR", str(tmp_path))
+
+    await async_client.get("/post", headers={config.PROFILE_HEADER: "wrong"})
+    assert list(tmp_path.iterdir()) == []
+
+    await async_client.get("/post", headers={config.PROFILE_HEADER: "secret"})
+    assert len(list(tmp_path.glob("*.folded"))) == 1
+
+
+@pytest.mark.anyio
+async def test_profile_slow_request(async_client: AsyncClient, tmp_path, mocker):
+    mocker.patch.object(config, "PROFILE_DIR", str(tmp_path))
+    mocker.patch.object(config, "PROFILE_SLOW_REQUEST_MS", 10_000.0)
+
+    await async_client.get("/post")
+    assert list(tmp_path.iterdir()) == []  # Not slow enough
+
+    mocker.patch.object(config, "PROFILE_SLOW_REQUEST_MS", 0.0)
+    await async_client.get("/post")
+    assert len(list(tmp_path.glob("*.folded"))) == 1
+
+
+def busy_watched():
+    end = time.perf_counter() + 0.1
+    while time.perf_counter() < end:
+        pass
+
+
+def busy_other():
+    end = time.perf_counter() + 0.1
+    while time.perf_counter() < end:
+        pass
+
+
+@pytest.mark.anyio
+async def test_stack_sampler_credits_running_request(mocker):
+    mocker.patch.object(config, "PROFILE_SAMPLE_INTERVAL_MS", 1.0)
+
+    async def watched():
+        task = asyncio.current_task()
+        samples = tracing.stack_sampler.watch(task)
+        busy_watched()
+        await asyncio.sleep(0)  # Lets "other" run while this request is still watched
+        tracing.stack_sampler.unwatch(task)
+        return samples
+
+    async def other():
+        busy_other()
+
+    samples, _ = await asyncio.gather(watched(), other())
+
+    stacks = " ".join(samples)
+    assert "busy_watched" in stacks
+    assert "busy_other" not in stacks  # Ran on the same loop, but for another request